@@ -1,12 +1,24 @@
+import asyncio
+import atexit
+import bisect
 import copyreg
+import json
 import logging
 import os
+import random
+import sqlite3
+import time
 import types
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from multiprocessing import Pool, cpu_count, current_process
+from email.utils import parsedate_to_datetime
+from logging.handlers import BufferingHandler, QueueHandler, QueueListener
+from multiprocessing import Array, Pool, Queue, Value, cpu_count, current_process
+from typing import Optional, Tuple
 
+import aiohttp
 import numpy as np
 import pandas as pd
 import requests
@@ -28,6 +40,495 @@ def _pickle_method(m):
 
 copyreg.pickle(types.MethodType, _pickle_method)
 
+TMDB_API_URL = "https://api.themoviedb.org/3"
+# TMDB documents an upper limit of around 50 requests per second per IP, stay below it
+# https://developers.themoviedb.org/3/getting-started/request-rate-limiting
+TMDB_RATE_LIMIT = 40
+# API fields served by a sub-resource of the movie details, by sub-resource. The other fields
+# come from the movie details. Sub-resources are fetched with the details in a single request
+# using append_to_response: https://developers.themoviedb.org/3/getting-started/append-to-response
+TMDB_DETAILS = "details"
+TMDB_SUB_RESOURCES = {
+    "cast": "credits",
+    "director": "credits",
+    "writer": "credits",
+    "producer": "credits",
+    "keywords": "keywords",
+}
+TMDB_CREW_JOBS = {
+    "director": "Director",
+    "writer": "Screenplay",
+    "producer": "Producer",
+}
+TMDB_CAST_LIMIT = 10
+# listener of the structured logging of the movies_ds logger, see _get_json_logger
+_json_log_listener = None
+
+
+class TMDBResponseCache:
+    """
+    Local cache of raw TMDB responses keyed by TMDB id, stored in a SQLite file with the
+    fetch timestamp. Entries expire after a TTL. Not found (404) answers are cached as
+    well (negative caching), so unavailable movies are not requested again until expired.
+    The cache can be shared by forked worker processes, each one opens its own connection.
+    Within a process the connection can be used from another thread, as long as the calls
+    are not concurrent (the async filler runs them all in a single cache thread).
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, negative_ttl=None):
+        """
+        Args:
+            path: The path of the SQLite cache file, created if needed.
+            ttl: The number of seconds a response is valid.
+            negative_ttl: The number of seconds a not found answer is valid, defaults to ttl.
+
+        Returns:
+            None.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._connection = None
+        self._pid = None
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(id TEXT PRIMARY KEY, status INTEGER, body TEXT, fetched_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection of the current process, connections are not fork safe"""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path, timeout=60, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        return {**self.__dict__, "_connection": None, "_pid": None}
+
+    def get(self, movie_id, offline: bool = False):
+        """
+        Get the cached response of the given movie.
+
+        Args:
+            movie_id: The TMDB id of the movie.
+            offline: Whether expired entries are returned as well.
+
+        Returns:
+            - : None if the movie is not cached or expired, otherwise a (status, response)
+                tuple where response is the JSON response or None for a not found answer.
+        """
+        entry = (
+            self._connect()
+            .execute(
+                "SELECT status, body, fetched_at FROM responses WHERE id = ?",
+                (str(movie_id),),
+            )
+            .fetchone()
+        )
+        if entry is None:
+            return None
+
+        status, body, fetched_at = entry
+        ttl = self.ttl if status == 200 else self.negative_ttl
+        if not offline and time.time() - fetched_at > ttl:
+            return None
+
+        return status, json.loads(body) if body is not None else None
+
+    def put(self, movie_id, status: int, response: Optional[dict] = None):
+        """
+        Store the response (or not found answer if response is None) of the given movie.
+
+        Args:
+            movie_id: The TMDB id of the movie.
+            status: The HTTP status of the answer, 200 or 404.
+            response: The JSON response.
+
+        Returns:
+            None.
+        """
+        body = json.dumps(response) if response is not None else None
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (str(movie_id), status, body, time.time()),
+            )
+
+
+# the filler of a worker process, set once by the pool initializer instead of being pickled
+# with every task
+_worker_filler = None
+
+
+def _init_fill_worker(filler):
+    global _worker_filler
+    _worker_filler = filler
+
+
+def _fill_chunk(task: tuple) -> Tuple[int, dict, "FillMetrics"]:
+    start, total, df = task
+    _worker_filler.metrics.clear()
+    columns = _worker_filler._fill_func(df, start, total)
+    return len(df), columns, _worker_filler.metrics
+
+
+class FillMetrics:
+    """
+    Metrics of a fill run: filled cells by column (including the cells resumed from the
+    journal), rows resumed from the journal, requests, cache hits, request latency
+    histogram, answers by HTTP status and errors by exception type. Every worker process
+    collects the metrics of its chunk, they are merged into the metrics of the parent.
+    """
+
+    # upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.filled = Counter()
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.resumed = 0
+        self.requests = 0
+        self.cache_hits = 0
+        self.latency_counts = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def clear(self):
+        self.__init__()
+
+    def record_request(
+        self, latency: float, status: Optional[int] = None, error: Optional[str] = None
+    ):
+        """
+        Record a request.
+
+        Args:
+            latency: The duration of the request in seconds.
+            status: The HTTP status of the answer, None if there is no answer.
+            error: The exception type name if the request failed.
+
+        Returns:
+            None.
+        """
+        self.requests += 1
+        self.latency_counts[bisect.bisect_left(self.LATENCY_BUCKETS, latency)] += 1
+        self.latency_sum += latency
+        if status is not None:
+            self.statuses[status] += 1
+        if error is not None:
+            self.errors[error] += 1
+
+    def merge(self, other: "FillMetrics"):
+        """Add the metrics of another process"""
+        self.filled.update(other.filled)
+        self.statuses.update(other.statuses)
+        self.errors.update(other.errors)
+        self.resumed += other.resumed
+        self.requests += other.requests
+        self.cache_hits += other.cache_hits
+        self.latency_counts = [
+            count + other_count
+            for count, other_count in zip(self.latency_counts, other.latency_counts)
+        ]
+        self.latency_sum += other.latency_sum
+
+    def to_dict(self) -> dict:
+        """Returns the metrics as a JSON serializable dict"""
+        bounds = [str(bound) for bound in self.LATENCY_BUCKETS] + ["inf"]
+        return {
+            "filled": dict(self.filled),
+            "resumed": self.resumed,
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "statuses": {str(status): n for status, n in self.statuses.items()},
+            "errors": dict(self.errors),
+            "latency": {
+                "buckets": dict(zip(bounds, self.latency_counts)),
+                "mean": self.latency_sum / self.requests if self.requests else None,
+            },
+        }
+
+
+class RetryPolicy:
+    """
+    Retry policy of the transient TMDB errors: rate limiting (429), server errors,
+    connection errors and timeouts. The retries wait with an exponential backoff and full
+    jitter, or the time given by the Retry-After header of the answer.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        retry_statuses: tuple = (429, 500, 502, 503, 504),
+    ):
+        """
+        Args:
+            max_retries: The maximum number of retries of a request.
+            backoff: The maximum wait in seconds before the first retry, doubled at every retry.
+            max_backoff: The maximum wait in seconds before a retry, Retry-After excepted.
+            retry_statuses: The HTTP statuses that are retried.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns the seconds to wait before the retry of the given attempt (from 0)"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Returns the seconds of a Retry-After header (seconds or HTTP date), if any"""
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by the worker processes (and asyncio tasks). It keeps the
+    outcomes of the last requests and opens when their error rate reaches the threshold:
+    all the workers then pause their requests for the cooldown, instead of each of them
+    retrying against a throttling API. A Retry-After answer pauses all the workers as well.
+    """
+
+    def __init__(self, window: int = 20, error_rate: float = 0.5, cooldown: float = 10):
+        """
+        Args:
+            window: The number of last requests the error rate is computed on.
+            error_rate: The error rate opening the circuit.
+            cooldown: The number of seconds the circuit stays open.
+        """
+        self.window = window
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        # shared memory, inherited by the forked workers
+        self._outcomes = Array("b", window)
+        self._count = Value("i", 0, lock=False)
+        self._open_until = Value("d", 0.0, lock=False)
+
+    def record(self, error: bool, pause: Optional[float] = None) -> bool:
+        """
+        Record the outcome of a request.
+
+        Args:
+            error: Whether the request failed with a transient error.
+            pause: The seconds all the workers should wait, e.g. given by Retry-After.
+
+        Returns:
+            - : Whether the circuit has been opened by this outcome.
+        """
+        with self._outcomes.get_lock():
+            now = time.time()
+            if pause:
+                self._open_until.value = max(self._open_until.value, now + pause)
+
+            outcomes = self._outcomes.get_obj()
+            outcomes[self._count.value % self.window] = error
+            self._count.value += 1
+            if (
+                self._count.value >= self.window
+                and sum(outcomes) >= self.error_rate * self.window
+            ):
+                self._open_until.value = max(
+                    self._open_until.value, now + self.cooldown
+                )
+                self._count.value = 0
+                outcomes[:] = [0] * self.window
+                return True
+
+        return False
+
+    def remaining(self) -> float:
+        """Returns the seconds to wait before the next request, 0 if the circuit is closed"""
+        return max(0.0, self._open_until.value - time.time())
+
+
+class FillJournal:
+    """
+    Append-only journal of the filled rows of a fill run, used as a checkpoint. Every
+    process appends the rows it has processed to its own JSON lines file in the journal
+    directory, flushed row by row, so a killed run loses at most the rows in progress.
+    A later run reads the journal line by line to skip the ids already done.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The journal directory, created if needed.
+
+        Returns:
+            None.
+        """
+        self.path = path
+        self._file = None
+        self._pid = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def _open(self):
+        """Returns the journal file of the current process, file handles are not fork safe"""
+        if self._file is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            path = os.path.join(self.path, f"part-{self._pid}.jsonl")
+            self._file = open(path, "a", encoding="utf-8")
+            # terminate a line truncated by a killed run with the same pid
+            if os.path.getsize(path) > 0:
+                with open(path, "rb") as journal_file:
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b"\n":
+                        self._file.write("\n")
+        return self._file
+
+    def __getstate__(self):
+        return {**self.__dict__, "_file": None, "_pid": None}
+
+    def append(self, movie_id, fill_cols: list, values: dict):
+        """
+        Record a processed row.
+
+        Args:
+            movie_id: The TMDB id of the movie.
+            fill_cols: The columns requested for the movie.
+            values: The filled values by column name, the others cannot be filled.
+
+        Returns:
+            None.
+        """
+        journal_file = self._open()
+        journal_file.write(
+            json.dumps({"id": str(movie_id), "cols": fill_cols, "values": values})
+            + "\n"
+        )
+        journal_file.flush()
+
+    def load(self, movie_ids: set) -> dict:
+        """
+        Stream the journal and collect the records of the given movies, later records of
+        a movie are merged into the earlier ones. Truncated lines of a killed run are skipped.
+
+        Args:
+            movie_ids: The TMDB ids of the movies to collect, as strings.
+
+        Returns:
+            - : The (requested columns, filled values) tuple by movie id.
+        """
+        done = {}
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".jsonl"):
+                continue
+
+            with open(os.path.join(self.path, name), encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    if record["id"] not in movie_ids:
+                        continue
+
+                    fill_cols, values = done.setdefault(record["id"], (set(), {}))
+                    fill_cols.update(record["cols"])
+                    values.update(record["values"])
+
+        return done
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random sample of the per-row records (records with a movie_id) below the
+    warning level, the other records are always kept.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return (
+            record.levelno >= logging.WARNING
+            or not hasattr(record, "movie_id")
+            or random.random() < self.rate
+        )
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler sending the records to the listener of the parent process without
+    formatting them, the message is formatted by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonLinesHandler(BufferingHandler):
+    """
+    Writes the records as JSON lines (time, level, process, message and the extra fields of
+    the record) to a file, in batches of capacity records.
+    """
+
+    # attributes of every record, the others are extra fields
+    RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+        "message",
+        "asctime",
+    }
+
+    def __init__(self, path: str, capacity: int = 100):
+        super().__init__(capacity)
+        self.stream = open(path, "w", encoding="utf-8")
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                self.stream.write("".join(map(self._to_json, self.buffer)))
+                self.stream.flush()
+                self.buffer = []
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.stream.close()
+
+    def _to_json(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": record.created,
+            "level": record.levelname,
+            "process": record.processName,
+            "message": record.getMessage(),
+        }
+        line.update(
+            (key, val)
+            for key, val in record.__dict__.items()
+            if key not in self.RECORD_ATTRIBUTES
+        )
+        if record.exc_text:
+            line["exception"] = record.exc_text
+        return json.dumps(line, default=str) + "\n"
+
 
 class DataFillerAbstract(ABC):
     @abstractmethod
@@ -130,6 +631,76 @@ class DataFillerAbstract(ABC):
 
         return logger
 
+    @staticmethod
+    def _get_json_logger(
+        log_path: str, log_level: int, sample_rate: float = 1.0, batch_size: int = 100
+    ) -> Tuple[logging.Logger, QueueListener]:
+        """
+        The static method setup the movies_ds logger for structured logging. The records of
+        all the processes are put unformatted on a queue, and a listener thread of the parent
+        process writes them as JSON lines in batches. Warnings and errors are logged to stdout
+        as well.
+
+        Args:
+            log_path:  The JSON lines log file path.
+            log_level: The log level the logger will be logging.
+            sample_rate: The fraction of the per-row records below warning level logged.
+            batch_size: The number of records written at once.
+
+        Returns:
+            - : The logger and the started queue listener.
+        """
+        global _json_log_listener
+        # the logger is shared, so the listener of a previous setup is replaced
+        if _json_log_listener is not None:
+            DataFillerAbstract._stop_json_logger(_json_log_listener)
+
+        logger = logging.getLogger("movies_ds")
+        logger.setLevel(log_level)
+        logger.handlers = []
+        queue = Queue()
+        qh = DeferredQueueHandler(queue)
+        qh.addFilter(SamplingFilter(sample_rate))
+        logger.addHandler(qh)
+
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.WARNING)
+        ch.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+        listener = QueueListener(
+            queue,
+            JsonLinesHandler(log_path, batch_size),
+            ch,
+            respect_handler_level=True,
+        )
+        listener.start()
+        # registered after the queue, so that it runs before the exit finalizers of
+        # multiprocessing close the queue under the listener thread
+        atexit.register(DataFillerAbstract._stop_json_logger, listener)
+        _json_log_listener = listener
+
+        return logger, listener
+
+    @staticmethod
+    def _stop_json_logger(listener: QueueListener):
+        """
+        The static method stops the given listener of _get_json_logger, writing its queued
+        records, and closes its handlers. Nothing is done if it was already stopped.
+
+        Args:
+            listener: The queue listener returned by _get_json_logger.
+        """
+        global _json_log_listener
+        if listener is not _json_log_listener:
+            return
+
+        _json_log_listener = None
+        logging.getLogger("movies_ds").handlers = []
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
 
 class TMDBFiller(DataFillerAbstract):
     def __init__(
@@ -139,13 +710,53 @@ class TMDBFiller(DataFillerAbstract):
         config_path: str = "modules/config.ini",
         log_path: str = "log.txt",
         log_level: int = logging.INFO,
+        cache_path: Optional[str] = None,
+        cache_ttl: float = 30 * 24 * 3600,
+        offline: bool = False,
+        journal_path: Optional[str] = None,
+        chunk_size: int = 10,
+        progress_bar: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        log_format: str = "text",
+        log_sample_rate: float = 1.0,
+        log_batch_size: int = 100,
     ):
+        """
+        Init method for TMDB filler, see DataFillerAbstract for the common arguments.
+
+        Args:
+            cache_path: The path of a SQLite file caching the API responses by TMDB id.
+                        Only new or expired ids are requested. No caching if None.
+            cache_ttl: The number of seconds a cached response is valid.
+            offline: Whether to fill from the cache only (expired entries included),
+                     without any request.
+            journal_path: The directory of a journal checkpointing the filled rows. A run
+                          with the same journal skips the ids already done by a previous
+                          (killed) run. No checkpointing if None.
+            chunk_size: The number of rows of a task, idle workers take the next task so
+                        slow rows only hold up their own chunk.
+            progress_bar: Whether to show a progress bar with the throughput and ETA.
+            retry_policy: The retry policy of the transient errors, defaults to RetryPolicy().
+            circuit_breaker: The circuit breaker shared by the workers, defaults to
+                             CircuitBreaker().
+            log_format: text, or json for structured JSON lines logging through a queue,
+                        with the formatting deferred to the parent process.
+            log_sample_rate: The fraction of the per-row records logged in json format.
+            log_batch_size: The number of records written at once in json format.
+        """
         assert os.path.exists(config_path)
         config = ConfigParser()
         config.read(config_path)
         tmdb.API_KEY = str(config.get("tmdb", "token"))
-        self.logger = TMDBFiller._get_logger(log_path, log_level)
-        self.counter = defaultdict(int)
+        self._log_listener = None
+        if log_format == "json":
+            self.logger, self._log_listener = TMDBFiller._get_json_logger(
+                log_path, log_level, log_sample_rate, log_batch_size
+            )
+        else:
+            self.logger = TMDBFiller._get_logger(log_path, log_level)
+        self.metrics = FillMetrics()
 
         self.movies_df = df.copy()
 
@@ -161,168 +772,944 @@ class TMDBFiller(DataFillerAbstract):
                 raise
 
         self.fill_columns = fill_columns
+        self.cache = TMDBResponseCache(cache_path, cache_ttl) if cache_path else None
+        self.offline = offline
+        if self.offline and self.cache is None:
+            raise ValueError("Offline filling needs a cache_path")
+        self.journal = FillJournal(journal_path) if journal_path else None
+        self.chunk_size = chunk_size
+        self.progress_bar = progress_bar
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
 
-    def fill(self, n_workers: int = cpu_count()) -> pd.DataFrame:
+    @property
+    def counter(self) -> Counter:
+        """The number of filled cells by column of the last fill"""
+        return self.metrics.filled
+
+    def fill(
+        self,
+        n_workers: int = cpu_count(),
+        return_metrics: bool = False,
+        metrics_path: Optional[str] = None,
+    ):
+        """
+        Fill the dataframe, see DataFillerAbstract.fill.
+
+        Args:
+            n_workers: The number of workers for parallel processing.
+            return_metrics: Whether to return the metrics of the run with the dataframe.
+            metrics_path: The path of a JSON file the metrics of the run are written to.
+
+        Returns:
+            - : The filled dataframe, and the metrics dict if return_metrics.
+        """
+        started = time.perf_counter()
         self.logger.info(f"Using {n_workers} workers, filling is started.")
         # first filter rows that will be filled therefore we will process less rows
-        # normalize the column list for filtering operation
-        query_cols = {col: na_val for col, (_, na_val) in self.fill_columns.items()}
-        # create query string with given column list. <NA> value is recognized as null and therefore
-        # isna method is appended
-        query = []
-        for col, na_val in query_cols.items():
+        needs_fill = self._needs_fill_matrix()
+        positions = np.flatnonzero(needs_fill.any(axis=1))
+        needs_fill = needs_fill[positions]
+        # rows are indexed by their position, so workers can report filled cells by position.
+        # Workers only need the id and the columns to request for each row
+        fill_cols = np.array(list(self.fill_columns), dtype=object)
+        col_endpoints = np.array(
+            [
+                TMDB_SUB_RESOURCES.get(original_col_name, TMDB_DETAILS)
+                for original_col_name, _ in self.fill_columns.values()
+            ],
+            dtype=object,
+        )
+        filtered_df = pd.DataFrame(
+            {
+                "id": self.movies_df["id"].to_numpy()[positions],
+                "will_fill_cols": [list(fill_cols[needs]) for needs in needs_fill],
+                "endpoints": [frozenset(col_endpoints[needs]) for needs in needs_fill],
+            },
+            index=positions,
+        )
+        self.logger.info(f"Number of rows will be filled: {len(filtered_df)}")
+        self._log_request_plan(filtered_df["endpoints"])
+
+        self.metrics.clear()
+        filled_columns = []
+        if self.journal is not None:
+            filtered_df, resumed_columns = self._resume(filtered_df)
+            filled_columns.append(resumed_columns)
+        filled_columns += self._fill_rows(filtered_df, n_workers)
+        # after processing, write the filled cells only, keeping the original dtypes
+        self._apply_fill(filled_columns)
+        self._log_fill_stats(positions, needs_fill, filled_columns)
+
+        self.fill_metrics = {
+            "n_workers": n_workers,
+            "elapsed": time.perf_counter() - started,
+            **self.metrics.to_dict(),
+            "request_plan": self.request_plan,
+            "fill_stats": self.fill_stats,
+        }
+        self.logger.info(
+            f"Number of requests: {self.metrics.requests}, "
+            f"cache hits: {self.metrics.cache_hits}, "
+            f"by status: {self.fill_metrics['statuses']}, "
+            f"errors: {self.fill_metrics['errors']}"
+        )
+        if metrics_path is not None:
+            with open(metrics_path, "w") as metrics_file:
+                json.dump(self.fill_metrics, metrics_file, indent=2)
+
+        self._flush_logs()
+
+        if return_metrics:
+            return self.movies_df, self.fill_metrics
+        return self.movies_df
+
+    def close(self):
+        """
+        Stop the listener of the json log format, writing the queued records, and close the
+        log file. The filler can be used as a context manager closing it on exit.
+        """
+        if self._log_listener is not None:
+            TMDBFiller._stop_json_logger(self._log_listener)
+            self._log_listener = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush_logs(self):
+        """Write the queued records of the structured logging"""
+        if self._log_listener is not None and self._log_listener is _json_log_listener:
+            # stopping the listener processes all the queued records
+            self._log_listener.stop()
+            for handler in self._log_listener.handlers:
+                handler.flush()
+            self._log_listener.start()
+
+    def _needs_fill_matrix(self) -> np.ndarray:
+        """
+        Vectorized marking of the cells to fill. A cell needs filling if it is equal to the
+        na_val of its column, or if it is missing when na_val is <NA> (or None, NaN).
+
+        Returns:
+            - : The boolean matrix of rows x fill columns.
+        """
+        needs_fill = np.zeros((len(self.movies_df), len(self.fill_columns)), dtype=bool)
+        for j, (col, (_, na_val)) in enumerate(self.fill_columns.items()):
+            values = self.movies_df[col]
             if na_val == "<NA>" or na_val is None or pd.isna(na_val):
-                query.append(f"{col}.isna()")
+                needs_fill[:, j] = values.isna().to_numpy()
             else:
-                query.append(f"{col}=={na_val}")
+                needs_fill[:, j] = values.eq(na_val).fillna(False).to_numpy(dtype=bool)
 
-        # join query string list and filter using this query string
-        query = " | ".join(query)
-        filtered_df = self.movies_df.query(query, inplace=False, engine="python")
-        self.logger.info(f"Number of rows will be filled: {len(filtered_df)}")
+        return needs_fill
+
+    def _resume(self, filtered_df: pd.DataFrame) -> Tuple[pd.DataFrame, dict]:
+        """
+        Take the rows already done from the journal.
+
+        Args:
+            filtered_df: The rows that need to be filled, see _fill_rows.
+
+        Returns:
+            - : The rows still to be filled, and the filled values of the rows done, see
+                _to_columns.
+        """
+        movie_ids = filtered_df["id"].astype(str)
+        done = self.journal.load(set(movie_ids))
+        rows = []
+        is_done = np.zeros(len(filtered_df), dtype=bool)
+        for i, (movie_id, row) in enumerate(zip(movie_ids, filtered_df.itertuples())):
+            if movie_id in done and done[movie_id][0].issuperset(row.will_fill_cols):
+                values = done[movie_id][1]
+                self.metrics.filled.update(
+                    col for col in row.will_fill_cols if col in values
+                )
+                rows.append(
+                    {
+                        "index": row.Index,
+                        **{
+                            col: values[col]
+                            for col in row.will_fill_cols
+                            if col in values
+                        },
+                    }
+                )
+                is_done[i] = True
+
+        self.metrics.resumed = len(rows)
+        self.logger.info(f"Number of rows already done in the journal: {len(rows)}")
+        return filtered_df[~is_done], self._to_columns(rows)
+
+    def _log_request_plan(self, endpoints: pd.Series):
+        """
+        Log how many requests are saved by fetching all the endpoints of a movie in a single
+        request, instead of one request per endpoint. Cached responses are not taken into
+        account, so these are upper bounds. They are kept in request_plan.
 
-        # for parallel processing, split, process and then concat
-        df_split = np.array_split(filtered_df, n_workers)
-        pool = Pool(n_workers)
-        # fill_df = pd.concat(list(tqdm.tqdm(pool.imap(self._fill_func, df_split), total=len(filtered_df))))
-        fill_df = pd.concat(pool.map(self._fill_func, df_split))
-        # after concat, update original dataframe and preserve original dtypes
-        original_dtypes = self.movies_df.dtypes
-        self.movies_df.update(fill_df)
-        # filtered_dtypes = self.movies_df.dtypes[self.movies_df.dtypes.index.isin(self.fill_columns.keys())]
-        self.movies_df = self.movies_df.astype(original_dtypes)
+        Args:
+            endpoints: The set of endpoints needed by each row.
+
+        Returns:
+            None.
+        """
+        naive_requests = int(endpoints.map(len).sum())
+        self.request_plan = {
+            "requests": len(endpoints),
+            "naive_requests": naive_requests,
+            "saved_requests": naive_requests - len(endpoints),
+        }
         self.logger.info(
-            f"Number of rows fully filled: "
-            f'{len(filtered_df) - len(self.movies_df.query(query, inplace=False, engine="python"))}'
-            f"There may be partially filled rows"
+            f"Request plan: {self.request_plan['requests']} requests instead of "
+            f"{naive_requests} with one request per endpoint, "
+            f"{self.request_plan['saved_requests']} requests saved"
         )
+
+    def _log_fill_stats(
+        self, positions: np.ndarray, needs_fill: np.ndarray, filled_columns: list
+    ):
+        """
+        Compute and log the fill statistics from the cells needing a fill and the filled
+        cells, without filtering the dataframe again. They are kept in fill_stats.
+
+        Args:
+            positions: The positions of the rows that needed filling.
+            needs_fill: The needs fill matrix of these rows.
+            filled_columns: The filled values of every chunk, see _to_columns.
+
+        Returns:
+            None.
+        """
+        filled = np.zeros_like(needs_fill)
+        for j, col in enumerate(self.fill_columns):
+            for columns in filled_columns:
+                if col in columns:
+                    filled[np.searchsorted(positions, columns[col][0]), j] = True
+
+        any_filled = filled.any(axis=1)
+        remaining = (needs_fill & ~filled).any(axis=1)
+        self.fill_stats = {
+            "rows": len(positions),
+            "fully_filled_rows": int((~remaining).sum()),
+            "partially_filled_rows": int((any_filled & remaining).sum()),
+            "unfilled_rows": int((~any_filled).sum()),
+            "cells": dict(zip(self.fill_columns, needs_fill.sum(axis=0).tolist())),
+            "filled_cells": dict(zip(self.fill_columns, filled.sum(axis=0).tolist())),
+        }
+        self.logger.info(
+            f"Number of rows fully filled: {self.fill_stats['fully_filled_rows']}, "
+            f"partially filled: {self.fill_stats['partially_filled_rows']}, "
+            f"not filled: {self.fill_stats['unfilled_rows']}. "
+            f"Filled cells by column: {self.fill_stats['filled_cells']} "
+            f"out of {self.fill_stats['cells']}"
+        )
+
+    def _fill_rows(self, filtered_df: pd.DataFrame, n_workers: int) -> list:
+        """
+        Fill the filtered rows in parallel: split them into small chunks dispatched to the
+        n_workers as they get idle.
+
+        Args:
+            filtered_df: The ids of the rows that need to be filled with the columns to fill
+                         (will_fill_cols), indexed by their position.
+            n_workers: The number of workers for parallel processing.
+
+        Returns:
+            - : The filled values of every chunk, see _to_columns.
+        """
+        total = len(filtered_df)
+        tasks = (
+            (start, total, filtered_df.iloc[start : start + self.chunk_size])
+            for start in range(0, total, self.chunk_size)
+        )
+        filled_columns = []
+        pool = Pool(n_workers, initializer=_init_fill_worker, initargs=(self,))
+        with tqdm.tqdm(
+            total=total, unit="row", disable=not self.progress_bar
+        ) as progress:
+            for n_rows, columns, metrics in pool.imap_unordered(_fill_chunk, tasks):
+                filled_columns.append(columns)
+                self.metrics.merge(metrics)
+                progress.update(n_rows)
         pool.close()
         pool.join()
 
-        return self.movies_df
+        return filled_columns
 
-    def _fill_func(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _fill_func(
+        self, df: pd.DataFrame, start: int = 0, total: Optional[int] = None
+    ) -> dict:
+        total = len(df) if total is None else total
         rows = [
-            self._fill_row(len(df), index + 1, row)
+            self._fill_row(total, start + index + 1, row)
             for index, row in enumerate(df.itertuples())
         ]
-        return pd.DataFrame.from_dict(rows, orient="columns").set_index("index")
+        return self._to_columns(rows)
+
+    @staticmethod
+    def _to_columns(rows: list) -> dict:
+        """
+        Convert filled row dicts to columns.
+
+        Args:
+            rows: The filled values of every row by column name, with the row position
+                  under the index key.
+
+        Returns:
+            - : The filled cells by column name as a (row positions, values) tuple of lists.
+        """
+        columns = {}
+        for row_dict in rows:
+            position = row_dict.pop("index")
+            for col, val in row_dict.items():
+                positions, values = columns.setdefault(col, ([], []))
+                positions.append(position)
+                values.append(val)
+
+        return columns
+
+    def _apply_fill(self, filled_columns: list):
+        """
+        Write the filled cells into the dataframe with positional indexing. The values are
+        converted to the original dtype of their column, other columns are not touched.
+
+        Args:
+            filled_columns: The filled values of every chunk, see _to_columns.
+
+        Returns:
+            None.
+        """
+        for col in self.fill_columns:
+            chunks = [columns[col] for columns in filled_columns if col in columns]
+            if not chunks:
+                continue
+
+            positions = [position for chunk in chunks for position in chunk[0]]
+            values = [val for chunk in chunks for val in chunk[1]]
+            dtype = self.movies_df[col].dtype
+            self.movies_df.iloc[positions, self.movies_df.columns.get_loc(col)] = (
+                pd.array(values, dtype=dtype)
+            )
 
     def _fill_row(self, total: int, index: int, row: tuple) -> dict:
         row_dict = {"index": row.Index}
-        curr_process_name = current_process().name
-        will_fill_cols = []
-        # Mark all the not available columns for this row
-        for col, (_, na_val) in self.fill_columns.items():
-            field_val = getattr(row, col)
-            # if we need to fill NA values and the field is None
-            if field_val is None or pd.isna(field_val):
-                if na_val == "<NA>":
-                    will_fill_cols.append(col)
-
-            #   if the field not None, check whether it is equal or not
-            else:
-                if field_val == na_val:
-                    will_fill_cols.append(col)
+        will_fill_cols = row.will_fill_cols
 
         if will_fill_cols:
+            movie_id = getattr(row, "id")
+            response = self._fetch(movie_id, row.endpoints, total, index)
+            if response:
+                row_dict.update(
+                    self._parse_response(
+                        response, will_fill_cols, total, index, movie_id
+                    )
+                )
+            if response is not None:
+                self._journal_row(movie_id, will_fill_cols, row_dict)
+
+        return row_dict
+
+    def _journal_row(self, movie_id, will_fill_cols: list, row_dict: dict):
+        """
+        Record a row answered by the API in the journal, including the movies not available
+        which have no values. Failed requests are not recorded, so they are retried.
+        """
+        if self.journal is not None:
+            values = {col: val for col, val in row_dict.items() if col != "index"}
+            self.journal.append(movie_id, will_fill_cols, values)
+
+    def _fetch(
+        self, movie_id, endpoints: frozenset, total: int, index: int
+    ) -> Optional[dict]:
+        """
+        Returns the movie response of the API with the given endpoints, completing the cached
+        response if it is cached. All the missing endpoints are fetched in a single request.
+        An empty dict if the movie is not available, None if the request failed.
+        """
+        cached = self._get_cached(movie_id, total, index)
+        if cached == {} or self.offline:
+            return cached
+
+        missing_endpoints = self._missing_endpoints(cached, endpoints)
+        if not missing_endpoints:
+            return cached
+
+        sub_resource, append = self._plan_request(missing_endpoints)
+        response = self._request(movie_id, sub_resource, append, total, index)
+        if not response:
+            return response
+
+        response = {**(cached or {}), **response}
+        if self.cache is not None:
+            self.cache.put(movie_id, 200, response)
+        return response
+
+    def _request(
+        self,
+        movie_id,
+        sub_resource: Optional[str],
+        append: list,
+        total: int,
+        index: int,
+    ) -> Optional[dict]:
+        """
+        Request the API with the retry policy, waiting while the circuit breaker is open.
+        An empty dict if the movie is not available, None if the request failed.
+        """
+        for attempt in range(self.retry_policy.max_retries + 1):
+            time.sleep(self.circuit_breaker.remaining())
+            retry_after = None
+            requested = time.perf_counter()
             try:
-                movie_id = getattr(row, "id")
                 movie = tmdb.Movies(movie_id)
-                response = movie.info()
+                if sub_resource is None:
+                    response = movie.info(**self._append_params(append))
+                else:
+                    response = {sub_resource: getattr(movie, sub_resource)()}
+                # formatted only if debug is enabled, responses are large
                 self.logger.debug(
-                    f"[{index}/{total}]ID: {movie_id} Response: {response}"
+                    "[%s/%s]ID: %s Response: %s",
+                    index,
+                    total,
+                    movie_id,
+                    response,
+                    extra={"movie_id": movie_id},
                 )
             except requests.exceptions.HTTPError as errh:
+                status = errh.response.status_code
+                self.metrics.record_request(
+                    time.perf_counter() - requested, status, type(errh).__name__
+                )
                 self.logger.error(
                     f"Http Error:[{index}/{total}]ID: {movie_id} | {str(errh)}"
                 )
-            except requests.exceptions.ConnectionError as errc:
-                self.logger.error(
-                    f"Http Error:[{index}/{total}]ID: {movie_id} | {str(errc)}"
+                if status == 404:
+                    self.circuit_breaker.record(False)
+                    if self.cache is not None:
+                        self.cache.put(movie_id, 404)
+                    return {}
+                if status not in self.retry_policy.retry_statuses:
+                    return None
+                retry_after = self.retry_policy.parse_retry_after(
+                    errh.response.headers.get("Retry-After")
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as errc:
+                self.metrics.record_request(
+                    time.perf_counter() - requested, error=type(errc).__name__
                 )
-            except requests.exceptions.Timeout as errt:
                 self.logger.error(
-                    f"Http Error:[{index}/{total}]ID: {movie_id} | {str(errt)}"
+                    f"Http Error:[{index}/{total}]ID: {movie_id} | {str(errc)}"
                 )
             except requests.exceptions.RequestException as err:
+                self.metrics.record_request(
+                    time.perf_counter() - requested, error=type(err).__name__
+                )
                 self.logger.error(
                     f"Http Error:[{index}/{total}]ID: {movie_id} | {str(err)}"
                 )
+                return None
             else:
-                # some fields may need a special treating so I have separated case by case
-                # api fields name can be check here: https://developers.themoviedb.org/3/movies/get-movie-details
-                for col in will_fill_cols:
-                    original_col_name, _ = self.fill_columns[col]
-                    val = getattr(movie, original_col_name, None)
-                    if val is not None:
-                        if original_col_name in [
-                            "adult",
-                            "popularity",
-                            "runtime",
-                            "status",
-                            "video",
-                            "vote_average",
-                            "vote_count",
-                        ]:
-                            # may need special treatment later
-                            pass
-                        elif (
-                            original_col_name in ["revenue", "budget"] and int(val) > 0
-                        ):
-                            val = int(val)
-                        elif (
-                            original_col_name
-                            in [
-                                "tagline",
-                                "release_date",
-                                "original_language",
-                                "original_title",
-                                "backdrop_path",
-                                "homepage",
-                                "imdb_id",
-                                "overview",
-                                "poster_path",
-                                "title",
-                            ]
-                            and len(val) > 0
-                        ):
-                            val = str(val)
-                        elif original_col_name == "spoken_languages" and len(val) > 0:
-                            val = val[0]["iso_639_1"]
-
-                        elif (
-                            original_col_name
-                            in [
-                                "genres",
-                                "production_companies",
-                                "production_countries",
-                            ]
-                            and len(val) > 0
-                        ):
-                            val = ", ".join((str(_val["name"]) for _val in val))
-
-                        elif original_col_name in ["belongs_to_collection"]:
-                            val = val["name"]
-
-                        else:
-                            self.logger.error(
-                                f"[{curr_process_name}:{index}/{total}]ID: {movie_id} Name:{movie.title} "
-                                f"¦ Given field name: {original_col_name} for column name: {col} "
-                                f"is not valid or empty value, val:{val}"
-                            )
-                            continue
+                self.metrics.record_request(time.perf_counter() - requested, 200)
+                self.circuit_breaker.record(False)
+                return response
 
-                        row_dict[col] = val
-                        self.counter[col] += 1
-                        self.logger.info(
-                            f"[{curr_process_name}:{index}/{total}]ID: {movie_id} Name:{movie.title} "
-                            f"¦ Missing field: {col} has been filled with: {val}"
-                        )
+            if not self._retry(movie_id, attempt, retry_after, total, index):
+                return None
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+        return None
+
+    def _retry(
+        self,
+        movie_id,
+        attempt: int,
+        retry_after: Optional[float],
+        total: int,
+        index: int,
+    ) -> bool:
+        """Record a transient error in the circuit breaker, returns whether to retry"""
+        if self.circuit_breaker.record(True, retry_after):
+            self.logger.warning(
+                f"Circuit breaker opened, requests are paused for "
+                f"{self.circuit_breaker.remaining():.1f} seconds"
+            )
+        if attempt == self.retry_policy.max_retries:
+            return False
+
+        self.logger.info(
+            "[%s/%s]ID: %s ¦ Retry %s/%s",
+            index,
+            total,
+            movie_id,
+            attempt + 1,
+            self.retry_policy.max_retries,
+            extra={"movie_id": movie_id},
+        )
+        return True
+
+    @staticmethod
+    def _missing_endpoints(response: Optional[dict], endpoints: frozenset) -> set:
+        """Returns the endpoints which are not part of the given (cached) response"""
+        if response is None:
+            return set(endpoints)
+
+        # the movie details are always answered with the title, the sub-resources are keyed
+        # by their name as with append_to_response
+        fetched = {TMDB_DETAILS} if "title" in response else set()
+        fetched.update(endpoint for endpoint in endpoints if endpoint in response)
+        return set(endpoints) - fetched
+
+    @staticmethod
+    def _plan_request(endpoints: set) -> Tuple[Optional[str], list]:
+        """
+        Plans a single request for the given endpoints. A single sub-resource is requested
+        alone, otherwise the sub-resources are appended to the movie details request.
+
+        Args:
+            endpoints: The endpoints to fetch, details or sub-resources.
+
+        Returns:
+            - : The sub-resource to request or None for the movie details, and the
+                sub-resources to append to the movie details.
+        """
+        sub_resources = sorted(endpoints - {TMDB_DETAILS})
+        if TMDB_DETAILS not in endpoints and len(sub_resources) == 1:
+            return sub_resources[0], []
+
+        return None, sub_resources
+
+    @staticmethod
+    def _append_params(append: list) -> dict:
+        """Returns the query parameters appending the given sub-resources"""
+        return {"append_to_response": ",".join(append)} if append else {}
+
+    def _get_cached(self, movie_id, total: int, index: int) -> Optional[dict]:
+        """
+        Returns the cached response of the movie, an empty dict if the movie is cached as
+        not available and None if it is not cached.
+        """
+        if self.cache is None:
+            return None
+
+        cached = self.cache.get(movie_id, offline=self.offline)
+        if cached is None:
+            return None
+
+        self.metrics.cache_hits += 1
+        status, response = cached
+        if status != 200:
+            self.logger.info(
+                "[%s/%s]ID: %s ¦ Cached as not available",
+                index,
+                total,
+                movie_id,
+                extra={"movie_id": movie_id},
+            )
+            return {}
+
+        return response
+
+    def _parse_response(
+        self, response: dict, will_fill_cols: list, total: int, index: int, movie_id
+    ) -> dict:
+        """
+        Extract the values of the given fill columns from an API movie details response.
+
+        Args:
+            response: The JSON response of the movie details API.
+            will_fill_cols: The columns will be filled from the response.
+            total: The number of rows processed by the current worker, for logging.
+            index: The position of the row in the current worker, for logging.
+            movie_id: The TMDB id of the movie, for logging.
+
+        Returns:
+            - : The filled values by column name.
+        """
+        curr_process_name = current_process().name
+        title = response.get("title")
+        row_dict = {}
+        # some fields may need a special treating so I have separated case by case
+        # api fields name can be check here: https://developers.themoviedb.org/3/movies/get-movie-details
+        for col in will_fill_cols:
+            original_col_name, _ = self.fill_columns[col]
+            if original_col_name in TMDB_SUB_RESOURCES:
+                val = self._parse_sub_resource(response, original_col_name)
+            else:
+                val = response.get(original_col_name, None)
+            if val is not None:
+                if original_col_name in TMDB_SUB_RESOURCES:
+                    # already joined by _parse_sub_resource
+                    pass
+                elif original_col_name in [
+                    "adult",
+                    "popularity",
+                    "runtime",
+                    "status",
+                    "video",
+                    "vote_average",
+                    "vote_count",
+                ]:
+                    # may need special treatment later
+                    pass
+                elif original_col_name in ["revenue", "budget"] and int(val) > 0:
+                    val = int(val)
+                elif (
+                    original_col_name
+                    in [
+                        "tagline",
+                        "release_date",
+                        "original_language",
+                        "original_title",
+                        "backdrop_path",
+                        "homepage",
+                        "imdb_id",
+                        "overview",
+                        "poster_path",
+                        "title",
+                    ]
+                    and len(val) > 0
+                ):
+                    val = str(val)
+                elif original_col_name == "spoken_languages" and len(val) > 0:
+                    val = val[0]["iso_639_1"]
+
+                elif (
+                    original_col_name
+                    in [
+                        "genres",
+                        "production_companies",
+                        "production_countries",
+                    ]
+                    and len(val) > 0
+                ):
+                    val = ", ".join((str(_val["name"]) for _val in val))
+
+                elif original_col_name in ["belongs_to_collection"]:
+                    val = val["name"]
+
+                else:
+                    self.logger.error(
+                        "[%s:%s/%s]ID: %s Name:%s ¦ Given field name: %s for column name: %s "
+                        "is not valid or empty value, val:%s",
+                        curr_process_name,
+                        index,
+                        total,
+                        movie_id,
+                        title,
+                        original_col_name,
+                        col,
+                        val,
+                        extra={"movie_id": movie_id, "column": col},
+                    )
+                    continue
+
+                row_dict[col] = val
+                self.metrics.filled[col] += 1
+                self.logger.info(
+                    "[%s:%s/%s]ID: %s Name:%s ¦ Missing field: %s has been filled with: %s",
+                    curr_process_name,
+                    index,
+                    total,
+                    movie_id,
+                    title,
+                    col,
+                    val,
+                    extra={"movie_id": movie_id, "column": col, "filled": True},
+                )
+
+            else:
+                self.logger.info(
+                    "[%s:%s/%s]ID: %s Name:%s ¦ Missing field: %s cannot be filled",
+                    curr_process_name,
+                    index,
+                    total,
+                    movie_id,
+                    title,
+                    col,
+                    extra={"movie_id": movie_id, "column": col, "filled": False},
+                )
+
+        return row_dict
+
+    @staticmethod
+    def _parse_sub_resource(response: dict, original_col_name: str) -> Optional[str]:
+        """
+        Returns the comma separated names of the given sub-resource field (cast, crew job or
+        keywords), None if there is no name.
+        """
+        resource = response.get(TMDB_SUB_RESOURCES[original_col_name]) or {}
+        if original_col_name == "cast":
+            people = resource.get("cast", [])[:TMDB_CAST_LIMIT]
+        elif original_col_name == "keywords":
+            people = resource.get("keywords", [])
+        else:
+            job = TMDB_CREW_JOBS[original_col_name]
+            people = [crew for crew in resource.get("crew", []) if crew["job"] == job]
+
+        names = [str(person["name"]) for person in people]
+        return ", ".join(names) if names else None
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by asyncio tasks. Tokens are refilled continuously
+    at the given rate up to the capacity, which is the allowed burst size.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: The number of tokens (requests) refilled per second.
+            capacity: The maximum number of tokens, defaults to rate.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncTMDBFiller(TMDBFiller):
+    """
+    TMDB filler fetching the movies with asyncio instead of worker processes. All requests
+    go through one keep-alive connection pool, with a limit on concurrent requests and a
+    token bucket rate limiter. The SQLite response cache is read and written in a single
+    cache thread, so it does not block the event loop. The filled dataframe is the same as
+    the one of TMDBFiller.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        fill_columns: dict,
+        base_url: str = TMDB_API_URL,
+        rate_limit: float = TMDB_RATE_LIMIT,
+        request_timeout: float = 10,
+        **kwargs,
+    ):
+        """
+        Init method for the async filler, see TMDBFiller for the other arguments.
+
+        Args:
+            base_url: The base URL of the TMDB API, can point to a local stub server.
+            rate_limit: The maximum number of requests per second.
+            request_timeout: The timeout of a single request in seconds.
+        """
+        super().__init__(df, fill_columns, **kwargs)
+        self.base_url = base_url.rstrip("/")
+        self.rate_limit = rate_limit
+        self.request_timeout = request_timeout
+
+    def fill(self, n_workers: int = 20, **kwargs):
+        """
+        Fill the dataframe, see TMDBFiller.fill for the other arguments.
+
+        Args:
+            n_workers: The maximum number of concurrent requests.
+
+        Returns:
+            - : The filled dataframe, and the metrics dict if return_metrics.
+        """
+        return super().fill(n_workers, **kwargs)
+
+    def _fill_rows(self, filtered_df: pd.DataFrame, n_workers: int) -> list:
+        coroutine = self._fill_rows_async(filtered_df, n_workers)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # an event loop is already running (e.g. in a notebook), run in another thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+
+    async def _fill_rows_async(
+        self, filtered_df: pd.DataFrame, concurrency: int
+    ) -> list:
+        """
+        Fill all the rows concurrently with a shared session and rate limiter, the cache
+        is used in a single thread.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        bucket = TokenBucket(self.rate_limit)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        total = len(filtered_df)
+
+        rows = []
+        with ThreadPoolExecutor(max_workers=1) as cache_executor:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                tasks = [
+                    self._fill_row_async(
+                        session,
+                        semaphore,
+                        bucket,
+                        cache_executor,
+                        total,
+                        index + 1,
+                        row,
+                    )
+                    for index, row in enumerate(filtered_df.itertuples())
+                ]
+                with tqdm.tqdm(
+                    total=total, unit="row", disable=not self.progress_bar
+                ) as progress:
+                    for task in asyncio.as_completed(tasks):
+                        rows.append(await task)
+                        progress.update()
+
+        return [self._to_columns(rows)]
+
+    async def _fill_row_async(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        bucket: TokenBucket,
+        cache_executor: ThreadPoolExecutor,
+        total: int,
+        index: int,
+        row: tuple,
+    ) -> dict:
+        row_dict = {"index": row.Index}
+        will_fill_cols = row.will_fill_cols
+        if not will_fill_cols:
+            return row_dict
+
+        movie_id = getattr(row, "id")
+        response = await self._fetch_async(
+            session,
+            semaphore,
+            bucket,
+            cache_executor,
+            movie_id,
+            row.endpoints,
+            total,
+            index,
+        )
+        if response:
+            row_dict.update(
+                self._parse_response(response, will_fill_cols, total, index, movie_id)
+            )
+        if response is not None:
+            self._journal_row(movie_id, will_fill_cols, row_dict)
 
-                    else:
-                        self.logger.info(
-                            f"[{curr_process_name}:{index}/{total}]ID: {movie_id} Name:{movie.title} "
-                            f"¦ Missing field: {col} cannot be filled"
-                        )
         return row_dict
+
+    async def _fetch_async(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        bucket: TokenBucket,
+        cache_executor: ThreadPoolExecutor,
+        movie_id,
+        endpoints: frozenset,
+        total: int,
+        index: int,
+    ) -> Optional[dict]:
+        """Async version of TMDBFiller._fetch, the cache is used in the cache thread"""
+        loop = asyncio.get_running_loop()
+        cached = None
+        if self.cache is not None:
+            cached = await loop.run_in_executor(
+                cache_executor, self._get_cached, movie_id, total, index
+            )
+        if cached == {} or self.offline:
+            return cached
+
+        missing_endpoints = self._missing_endpoints(cached, endpoints)
+        if not missing_endpoints:
+            return cached
+
+        sub_resource, append = self._plan_request(missing_endpoints)
+        url = f"{self.base_url}/movie/{movie_id}"
+        if sub_resource is not None:
+            url = f"{url}/{sub_resource}"
+
+        for attempt in range(self.retry_policy.max_retries + 1):
+            await asyncio.sleep(self.circuit_breaker.remaining())
+            retry_after = None
+            async with semaphore:
+                await bucket.acquire()
+                requested = time.perf_counter()
+                try:
+                    async with session.get(
+                        url,
+                        params={"api_key": tmdb.API_KEY, **self._append_params(append)},
+                    ) as http_response:
+                        http_response.raise_for_status()
+                        response = await http_response.json()
+                    if sub_resource is not None:
+                        response = {sub_resource: response}
+                    self.logger.debug(
+                        "[%s/%s]ID: %s Response: %s",
+                        index,
+                        total,
+                        movie_id,
+                        response,
+                        extra={"movie_id": movie_id},
+                    )
+                except aiohttp.ClientResponseError as errh:
+                    self.metrics.record_request(
+                        time.perf_counter() - requested,
+                        errh.status,
+                        type(errh).__name__,
+                    )
+                    self.logger.error(
+                        f"Http Error:[{index}/{total}]ID: {movie_id} | {repr(errh)}"
+                    )
+                    if errh.status == 404:
+                        self.circuit_breaker.record(False)
+                        if self.cache is not None:
+                            await loop.run_in_executor(
+                                cache_executor, self.cache.put, movie_id, 404
+                            )
+                        return {}
+                    if errh.status not in self.retry_policy.retry_statuses:
+                        return None
+                    retry_after = self.retry_policy.parse_retry_after(
+                        errh.headers.get("Retry-After") if errh.headers else None
+                    )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    self.metrics.record_request(
+                        time.perf_counter() - requested, error=type(err).__name__
+                    )
+                    self.logger.error(
+                        f"Http Error:[{index}/{total}]ID: {movie_id} | {repr(err)}"
+                    )
+                else:
+                    self.metrics.record_request(time.perf_counter() - requested, 200)
+                    self.circuit_breaker.record(False)
+                    response = {**(cached or {}), **response}
+                    if self.cache is not None:
+                        await loop.run_in_executor(
+                            cache_executor, self.cache.put, movie_id, 200, response
+                        )
+                    return response
+
+            if not self._retry(movie_id, attempt, retry_after, total, index):
+                return None
+            await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+
+        return None
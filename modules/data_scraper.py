@@ -1,9 +1,23 @@
-import re
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 
+# the parsing helpers are shared with the BoxOfficeSpider; they only depend on the
+# standard library, so importing them does not pull in Scrapy. They cannot live in
+# modules/ since the Scrapy project resolves "modules" to movie_scrapers/modules
+from movie_scrapers.scrapers.parsing import (
+    find_info,
+    find_money,
+    index_roles,
+    index_sections,
+)
+
+logger = logging.getLogger(__name__)
+
 
 def tableDataText(table):
     """Searches through <tr> (table rows) and inner <td> (table data) tags.
@@ -24,38 +38,152 @@ def tableDataText(table):
     return rows
 
 
-def get_essential(role, data):
-    """finds first value with given role
-    returns None if nothing is found"""
-    output = None
-    for row in data:
-        if row[1] == role and output == None:
-            output = row[0]
-        else:
-            continue
-    return output
-
-
-def find_money(list_, name):
-    """searches through a list and returns a numerical value from
-    sublist that contains given name"""
-
-    output = None
-    for sublist in list_:
-        if name in sublist and sublist[-1] != "–":
-            output = sublist[-1].replace("$", "").replace(",", "")
-    return output
-
-
-def find_info(list_, name):
-    """searches through a list and returns a specific value from
-    sublist that contains given name"""
-    output = None
-    for sublist in list_:
-        if name in sublist:
-            output = sublist[1]
+def get_essential(role, roles):
+    """finds first value with given role in the roles index (see index_roles)
+    returns None if nothing is found. Crew rows without a role are not indexed,
+    they used to raise an IndexError failing the whole page"""
+    output = roles.get(role)
+    return output[0] if output else None
+
+
+BOM_URL = "https://www.boxofficemojo.com/title/{}/credits/"
+BOM_COLUMNS = [
+    "movie_id",
+    "title",
+    "year",
+    "tagline",
+    "mpaa",
+    "release_date",
+    "run_time",
+    "distributor",
+    "director",
+    "writer",
+    "producer",
+    "composer",
+    "cinematographer",
+    "main_actor_1",
+    "main_actor_2",
+    "main_actor_3",
+    "main_actor_4",
+    "budget",
+    "domestic",
+    "international",
+    "worldwide",
+    "genre_1",
+    "genre_2",
+    "genre_3",
+    "genre_4",
+    "html",
+]
+
+
+def parse_bom_page(movie_id, text, html):
+    """extracts the essential movie info of a boxofficemojo.com credits page
+    input: imdb movie code, page text and page url
+    return: row of movie info, see BOM_COLUMNS"""
+
+    soup = BeautifulSoup(text, "html.parser")
+
+    general_info = soup.find_all("div", {"class": "a-section a-spacing-none"})
+    general_info = [
+        mon.get_text("@", strip=True).replace("(", "").replace(")", "").split("@")
+        for mon in general_info
+    ]
 
-    return output
+    # get Title year tagline
+    title_year_trivia = general_info[0]
+    for i in range(0, 3):
+        if i >= len(title_year_trivia):
+            title_year_trivia.append(None)
+
+    title = title_year_trivia[0]
+    year = title_year_trivia[1]
+    tagline = title_year_trivia[2]
+
+    # single pass over the sections, the fields are then looked up by label
+    sections = index_sections(general_info)
+
+    # get money
+    domestic = find_money(sections, "Domestic ")
+    international = find_money(sections, "International ")
+    worldwide = find_money(sections, "Worldwide")
+    budget = find_money(sections, "Budget")
+
+    # get picture rating(mpaa), runtime and genre
+    distributor = find_info(sections, "Domestic Distributor")
+    release_date = find_info(sections, "Earliest Release Date")
+    if release_date:
+        release_date = release_date.split(",")
+        release_date = release_date[0]
+
+    mpaa = find_info(sections, "MPAA")
+    run_time = find_info(sections, "Running Time")
+    genres = find_info(sections, "Genres")
+
+    if genres:
+        genres = genres.replace("\n", "").split()
+    else:
+        genres = []
+
+    for i in range(0, 4):
+        if i >= len(genres):
+            genres.append(None)
+
+    genre_1 = genres[0]
+    genre_2 = genres[1]
+    genre_3 = genres[2]
+    genre_4 = genres[3]
+
+    # get crew
+    crew = soup.find("table", {"id": "principalCrew"})
+    essential = index_roles(tableDataText(crew))
+    writer = get_essential("Writer", essential)
+    director = get_essential("Director", essential)
+    producer = get_essential("Producer", essential)
+    composer = get_essential("Composer", essential)
+    cinematographer = get_essential("Cinematographer", essential)
+
+    # get main actors
+    cast = tableDataText(soup.find("table", {"id": "principalCast"}))
+    cast = [actor[0] for actor in cast]
+
+    for i in range(0, 5):
+        if i >= len(cast):
+            cast.append(None)
+
+    main_actor_1 = cast[1]
+    main_actor_2 = cast[2]
+    main_actor_3 = cast[3]
+    main_actor_4 = cast[4]
+
+    return [
+        movie_id,
+        title,
+        year,
+        tagline,
+        mpaa,
+        release_date,
+        run_time,
+        distributor,
+        director,
+        writer,
+        producer,
+        composer,
+        cinematographer,
+        main_actor_1,
+        main_actor_2,
+        main_actor_3,
+        main_actor_4,
+        budget,
+        domestic,
+        international,
+        worldwide,
+        genre_1,
+        genre_2,
+        genre_3,
+        genre_4,
+        html,
+    ]
 
 
 def get_bom_data(imdb_codes):
@@ -63,36 +191,7 @@ def get_bom_data(imdb_codes):
     input: imdb movie codes in a format tt0000000
     return: Dataframe with movie info"""
 
-    movies_bom = [
-        [
-            "movie_id",
-            "title",
-            "year",
-            "tagline",
-            "mpaa",
-            "release_date",
-            "run_time",
-            "distributor",
-            "director",
-            "writer",
-            "producer",
-            "composer",
-            "cinematographer",
-            "main_actor_1",
-            "main_actor_2",
-            "main_actor_3",
-            "main_actor_4",
-            "budget",
-            "domestic",
-            "international",
-            "worldwide",
-            "genre_1",
-            "genre_2",
-            "genre_3",
-            "genre_4",
-            "html",
-        ]
-    ]
+    movies_bom = [list(BOM_COLUMNS)]
 
     for imdb_code in imdb_codes:
 
@@ -100,113 +199,85 @@ def get_bom_data(imdb_codes):
 
             movie_id = str(imdb_code)
 
-            html = "https://www.boxofficemojo.com/title/" + movie_id + "/credits/"
+            html = BOM_URL.format(movie_id)
             html_page = requests.get(html)
-            soup = BeautifulSoup(html_page.text, "html.parser")
-
-            general_info = soup.find_all("div", {"class": "a-section a-spacing-none"})
-            general_info = [
-                mon.get_text("@", strip=True)
-                .replace("(", "")
-                .replace(")", "")
-                .split("@")
-                for mon in general_info
-            ]
-
-            # get Title year tagline
-            title_year_trivia = general_info[0]
-            for i in range(0, 3):
-                if i >= len(title_year_trivia):
-                    title_year_trivia.append(None)
-
-            title = title_year_trivia[0]
-            year = title_year_trivia[1]
-            tagline = title_year_trivia[2]
-
-            # get money
-            domestic = find_money(general_info, "Domestic ")
-            international = find_money(general_info, "International ")
-            worldwide = find_money(general_info, "Worldwide")
-            budget = find_money(general_info, "Budget")
-
-            # get picture rating(mpaa), runtime and genre
-            distributor = find_info(general_info, "Domestic Distributor")
-            release_date = find_info(general_info, "Earliest Release Date")
-            if release_date:
-                release_date = release_date.split(",")
-                release_date = release_date[0]
-
-            mpaa = find_info(general_info, "MPAA")
-            run_time = find_info(general_info, "Running Time")
-            genres = find_info(general_info, "Genres")
-
-            if genres:
-                genres = genres.replace("\n", "").split()
-            else:
-                genres = []
-
-            for i in range(0, 4):
-                if i >= len(genres):
-                    genres.append(None)
-
-            genre_1 = genres[0]
-            genre_2 = genres[1]
-            genre_3 = genres[2]
-            genre_4 = genres[3]
-
-            # get crew
-            crew = soup.find("table", {"id": "principalCrew"})
-            essential = tableDataText(crew)
-            writer = get_essential("Writer", essential)
-            director = get_essential("Director", essential)
-            producer = get_essential("Producer", essential)
-            composer = get_essential("Composer", essential)
-            cinematographer = get_essential("Cinematographer", essential)
-
-            # get main actors
-            cast = tableDataText(soup.find("table", {"id": "principalCast"}))
-            cast = [actor[0] for actor in cast]
-
-            for i in range(0, 5):
-                if i >= len(cast):
-                    cast.append(None)
-
-            main_actor_1 = cast[1]
-            main_actor_2 = cast[2]
-            main_actor_3 = cast[3]
-            main_actor_4 = cast[4]
-
-            movies_bom.append(
-                [
-                    movie_id,
-                    title,
-                    year,
-                    tagline,
-                    mpaa,
-                    release_date,
-                    run_time,
-                    distributor,
-                    director,
-                    writer,
-                    producer,
-                    composer,
-                    cinematographer,
-                    main_actor_1,
-                    main_actor_2,
-                    main_actor_3,
-                    main_actor_4,
-                    budget,
-                    domestic,
-                    international,
-                    worldwide,
-                    genre_1,
-                    genre_2,
-                    genre_3,
-                    genre_4,
-                    html,
-                ]
-            )
+            movies_bom.append(parse_bom_page(movie_id, html_page.text, html))
         except:
             continue
 
     return movies_bom
+
+
+def _fetch_bom_page(session, movie_id, timeout):
+    html = BOM_URL.format(movie_id)
+    html_page = session.get(html, timeout=timeout)
+    html_page.raise_for_status()
+    return parse_bom_page(movie_id, html_page.text, html)
+
+
+def iter_bom_data(imdb_codes, n_workers=8, failures=None, timeout=30):
+    """streams the essential movie info of boxofficemojo.com pages, fetched concurrently
+    with a pooled session. At most 2 * n_workers pages are in flight, and the rows are
+    yielded as soon as they are parsed, so not in the order of the codes.
+    input: imdb movie codes in a format tt0000000 (any iterable), number of concurrent
+    requests, list the failures are appended to as (movie_id, reason) tuples and
+    request timeout in seconds
+    return: generator of rows of movie info, see BOM_COLUMNS"""
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=n_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    with session, ThreadPoolExecutor(max_workers=n_workers) as executor:
+        in_flight = {}
+        imdb_codes = iter(imdb_codes)
+        while True:
+            for imdb_code in imdb_codes:
+                movie_id = str(imdb_code)
+                future = executor.submit(_fetch_bom_page, session, movie_id, timeout)
+                in_flight[future] = movie_id
+                if len(in_flight) >= 2 * n_workers:
+                    break
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                movie_id = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except Exception as err:
+                    reason = f"{type(err).__name__}: {err}"
+                    logger.warning(f"{movie_id} cannot be scraped | {reason}")
+                    if failures is not None:
+                        failures.append((movie_id, reason))
+
+
+def write_bom_data(imdb_codes, path, failures_path=None, chunk_size=100, **kwargs):
+    """scrapes boxofficemojo.com pages concurrently (see iter_bom_data) and appends the
+    movie info to a CSV file every chunk_size movies, the failures are written to
+    failures_path if given
+    input: imdb movie codes in a format tt0000000, CSV path, failures CSV path,
+    number of movies per write and iter_bom_data arguments
+    return: number of movies written and failures"""
+
+    failures = []
+    n_movies = 0
+    pd.DataFrame(columns=BOM_COLUMNS).to_csv(path, index=False)
+    rows = iter_bom_data(imdb_codes, failures=failures, **kwargs)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        pd.DataFrame(chunk, columns=BOM_COLUMNS).to_csv(
+            path, mode="a", header=False, index=False
+        )
+        n_movies += len(chunk)
+
+    if failures_path is not None:
+        pd.DataFrame(failures, columns=["movie_id", "reason"]).to_csv(
+            failures_path, index=False
+        )
+
+    return n_movies, len(failures)
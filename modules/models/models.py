@@ -1,80 +1,271 @@
-from typing import Any, Dict, Union
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
 
 import catboost
+import numpy as np
 import pandas as pd
 
+# parameters of the model used to quantize the data, see catboost.Pool.quantize
+QUANTIZATION_PARAMS = [
+    "ignored_features",
+    "per_float_feature_quantization",
+    "border_count",
+    "max_bin",
+    "feature_border_type",
+    "nan_mode",
+    "input_borders",
+    "task_type",
+    "used_ram_limit",
+]
+
+
+def save_quantized_pool(
+    path: str,
+    X: Union[pd.DataFrame, pd.Series],
+    y: Any,
+    categorical_columns: Any = None,
+    **quantize_params: Dict,
+):
+    """
+    Quantize the data once (borders and categorical hashes) and save it as a binary
+    snapshot that can be loaded with load_quantized_pool. Catboost only stores numeric
+    labels in quantized pools, so labels are saved as indices of their sorted unique
+    values and the class names are written next to the snapshot.
+    Text features are not supported by the catboost quantized pool format.
+    :param path: path of the snapshot - str
+    :param X: training data - Union[pd.DataFrame, pd.Series]
+    :param y: labels - Any
+    :param categorical_columns: categorical feature columns - Any
+    :param quantize_params: quantization parameters, see catboost.Pool.quantize - Dict
+    """
+    class_names, labels = np.unique(np.asarray(y), return_inverse=True)
+    pool = catboost.Pool(X, labels, cat_features=categorical_columns)
+    pool.quantize(**quantize_params)
+    pool.save(path)
+
+    with open(path + ".classes.json", "w") as f:
+        json.dump(class_names.tolist(), f)
+
+
+def load_quantized_pool(path: str) -> Tuple[catboost.Pool, Optional[List[Any]]]:
+    """
+    Load a snapshot saved with save_quantized_pool.
+    :param path: path of the snapshot - str
+    :return: pool, class_names: the quantized pool and the class names of its label
+    indices, None if no class names were saved - Tuple[catboost.Pool, Optional[List]]
+    """
+    class_names = None
+    if os.path.isfile(path + ".classes.json"):
+        with open(path + ".classes.json") as f:
+            class_names = json.load(f)
+
+    return catboost.Pool("quantized://" + path), class_names
+
 
 class CatBoostModel(catboost.CatBoostClassifier):
     """
     Catboost model optimizer with hyperparameter search based on Bayesian optimization.
+    Pools built from the input data are cached, so calling several methods on the same
+    data quantizes it only once. An already built ``catboost.Pool`` can be given instead
+    of the data as well.
+    Quantized snapshots (see save_snapshot) cannot hold text features, so a model with
+    text_columns (e.g. the description) can only be trained from the data or a pool.
     """
 
     def __init__(
         self,
         categorical_columns: Any = None,
         text_columns: Any = None,
-        **catboost_param
+        pool_cache_size: int = 4,
+        pool_cache_fingerprint: bool = False,
+        **catboost_param,
     ):
+        """
+        :param categorical_columns: categorical feature columns - Any
+        :param text_columns: text feature columns - Any
+        :param pool_cache_size: number of pools kept in the cache, 0 disables caching - int
+        :param pool_cache_fingerprint: key the pool cache on a hash of the data content instead
+        of the identity of the data objects. Slower, but robust to equal copies of the data
+        and to in-place modifications - bool
+        :param catboost_param: parameters of the catboost classifier - Dict
+        """
         super().__init__(**catboost_param)
         self.categorical_columns = categorical_columns or catboost_param.get(
             "cat_features"
         )
         self.text_columns = text_columns or catboost_param.get("text_features")
+        self.pool_cache_size = pool_cache_size
+        self.pool_cache_fingerprint = pool_cache_fingerprint
+        self._pool_cache = OrderedDict()
 
-    def fit(self, X: Union[pd.DataFrame, pd.Series], y: Any = None, **fit_params: Dict):
-        train_pool = catboost.Pool(
-            X, y, cat_features=self.categorical_columns, text_features=self.text_columns
-        )
+    def fit(
+        self,
+        X: Union[pd.DataFrame, pd.Series, catboost.Pool, str],
+        y: Any = None,
+        **fit_params: Dict,
+    ):
+        self.snapshot_class_names_ = None
+        if isinstance(X, str):
+            train_pool, self.snapshot_class_names_ = load_quantized_pool(X)
+        else:
+            train_pool = self.get_pool(X, y)
 
         return super().fit(train_pool, **fit_params)
 
-    def predict(self, X: Union[pd.DataFrame, pd.Series], **predict_params: Dict):
-        pool = catboost.Pool(
-            X, cat_features=self.categorical_columns, text_features=self.text_columns
-        )
-        return super().predict(pool, **predict_params)
+    def predict(
+        self, X: Union[pd.DataFrame, pd.Series, catboost.Pool], **predict_params: Dict
+    ):
+        pool = self.get_pool(X)
+        predictions = super().predict(pool, **predict_params)
+        # models trained on a snapshot predict label indices
+        class_names = getattr(self, "snapshot_class_names_", None)
+        prediction_type = predict_params.get("prediction_type", "Class")
+        if class_names is not None and prediction_type == "Class":
+            predictions = np.asarray(class_names)[predictions.astype(int)]
+
+        return predictions
 
     def predict_proba(
-        self, X: Union[pd.DataFrame, pd.Series], **predict_proba_params: Dict
+        self,
+        X: Union[pd.DataFrame, pd.Series, catboost.Pool],
+        **predict_proba_params: Dict,
     ):
-        pool = catboost.Pool(
-            X, cat_features=self.categorical_columns, text_features=self.text_columns
-        )
+        pool = self.get_pool(X)
         return super().predict_proba(pool, **predict_proba_params)
 
-    def score(self, X: Union[pd.DataFrame, pd.Series], y: Any = None):
-        pool = catboost.Pool(
-            X, y, cat_features=self.categorical_columns, text_features=self.text_columns
-        )
+    def score(self, X: Union[pd.DataFrame, pd.Series, catboost.Pool], y: Any = None):
+        if getattr(self, "snapshot_class_names_", None) is not None:
+            return np.mean(self.predict(X).reshape(-1) == np.asarray(y))
+
+        pool = self.get_pool(X, y)
         return super().score(pool)
 
     def evaluate(
         self,
-        X_test: Union[pd.DataFrame, pd.Series],
+        X_test: Union[pd.DataFrame, pd.Series, catboost.Pool],
         y_test: Any,
         metric: str,
-        **eval_params: Dict
+        **eval_params: Dict,
     ):
-        pool = catboost.Pool(
-            X_test,
-            y_test,
-            cat_features=self.categorical_columns,
-            text_features=self.text_columns,
-        )
+        class_names = getattr(self, "snapshot_class_names_", None)
+        if class_names is not None and not isinstance(X_test, (str, catboost.Pool)):
+            # models trained on a snapshot know the label indices only
+            label_index = {name: index for index, name in enumerate(class_names)}
+            y_test = pd.Series(np.asarray(y_test).reshape(-1)).map(label_index)
+            if y_test.isna().any():
+                raise ValueError(
+                    f"y_test has labels unknown to the model: {class_names}"
+                )
+            y_test = y_test.to_numpy(dtype="int64")
+
+        pool = self.get_pool(X_test, y_test)
         return super().eval_metrics(pool, [metric], **eval_params)
 
     def cv(
         self,
-        X: Union[pd.DataFrame, pd.Series],
+        X: Union[pd.DataFrame, pd.Series, catboost.Pool, str],
         y: Any,
         verbose: bool = False,
-        **cv_params: Dict
+        **cv_params: Dict,
     ) -> Union[pd.DataFrame, Dict]:
-        pool = catboost.Pool(
-            X, y, cat_features=self.categorical_columns, text_features=self.text_columns
-        )
+        pool = self.get_pool(X, y)
         validation_scores = catboost.cv(pool, self.get_params(), **cv_params)
         if verbose:
             print(validation_scores)
 
         return validation_scores
+
+    def save_snapshot(self, X: Union[pd.DataFrame, pd.Series], y: Any, path: str):
+        """
+        Quantize the data with the quantization parameters of the model and save it as
+        a snapshot, which can be given as path to fit and cv instead of the data.
+        Training on the snapshot gives the same model as training on the data.
+        Models with text_columns cannot use snapshots: catboost tokenizes text features
+        when quantizing and cannot train on or save the result.
+        """
+        params = self.get_params()
+        quantize_params = {
+            name: params[name] for name in QUANTIZATION_PARAMS if name in params
+        }
+        if "random_seed" in params:
+            quantize_params["random_seed"] = params["random_seed"]
+        if self.text_columns:
+            raise ValueError(
+                f"Text features {self.text_columns} cannot be stored in a quantized snapshot, "
+                f"train on the data or on a pool (cached by get_pool) instead"
+            )
+
+        save_quantized_pool(path, X, y, self.categorical_columns, **quantize_params)
+
+    def get_pool(
+        self, X: Union[pd.DataFrame, pd.Series, catboost.Pool, str], y: Any = None
+    ) -> catboost.Pool:
+        """
+        Returns the pool of the given data, built once and then served from the cache.
+        A given pool is returned as it is and a given path is loaded as a snapshot.
+        """
+        if isinstance(X, catboost.Pool):
+            return X
+
+        if isinstance(X, str):
+            return load_quantized_pool(X)[0]
+
+        cache = self.__dict__.setdefault("_pool_cache", OrderedDict())
+        cache_size = getattr(self, "pool_cache_size", 0)
+        fingerprint = getattr(self, "pool_cache_fingerprint", False)
+        key = self._pool_key(X, y)
+        entry = cache.get(key)
+        # identity keys are only valid while the keyed objects are alive, so they are
+        # kept in the entry and checked
+        if entry is not None and (fingerprint or (entry[0] is X and entry[1] is y)):
+            cache.move_to_end(key)
+            return entry[2]
+
+        pool = catboost.Pool(
+            X, y, cat_features=self.categorical_columns, text_features=self.text_columns
+        )
+        if cache_size > 0:
+            cache[key] = (None, None, pool) if fingerprint else (X, y, pool)
+            while len(cache) > cache_size:
+                cache.popitem(last=False)
+
+        return pool
+
+    def invalidate_pool_cache(self, X: Optional[Union[pd.DataFrame, pd.Series]] = None):
+        """
+        Drop the cached pools built from X, or all cached pools if X is None.
+        Needed after modifying cached data in place when keys are not fingerprints.
+        """
+        cache = self.__dict__.setdefault("_pool_cache", OrderedDict())
+        if X is None:
+            cache.clear()
+            return
+
+        data_key = self._data_key(X)
+        for key in [key for key in cache if key[0] == data_key]:
+            del cache[key]
+
+    def _pool_key(self, X: Union[pd.DataFrame, pd.Series], y: Any) -> Hashable:
+        """Cache key of a pool: identity or fingerprint of the data plus feature columns"""
+        columns = (
+            tuple(self.categorical_columns or ()),
+            tuple(self.text_columns or ()),
+        )
+        if not getattr(self, "pool_cache_fingerprint", False):
+            y_key = id(y)
+        else:
+            y_key = None if y is None else self._data_key(pd.Series(y))
+
+        return self._data_key(X), y_key, X.shape, columns
+
+    def _data_key(self, data: Union[pd.DataFrame, pd.Series]) -> Hashable:
+        """Identity of the data, or a hash of its content in fingerprint mode"""
+        if not getattr(self, "pool_cache_fingerprint", False):
+            return id(data)
+
+        digest = hashlib.sha1(str(list(getattr(data, "columns", []))).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy())
+        return digest.hexdigest()
@@ -1,15 +1,31 @@
+import inspect
 import logging
-import time
-from typing import Any, Dict, Optional, Tuple
+import multiprocessing
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Any, Dict, Optional, Tuple, Union
 
 import optuna
 import pandas as pd
-from sklearn.model_selection import (
-    KFold,
-    StratifiedKFold,
-    cross_val_score,
-    train_test_split,
-)
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
+from optuna.trial import TrialState
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import KFold, StratifiedKFold, train_test_split
+
+PRUNERS = {
+    "median": lambda n_fold: optuna.pruners.MedianPruner(),
+    "successive_halving": lambda n_fold: optuna.pruners.SuccessiveHalvingPruner(
+        min_resource=1
+    ),
+    "hyperband": lambda n_fold: optuna.pruners.HyperbandPruner(
+        min_resource=1, max_resource=n_fold
+    ),
+    "none": lambda n_fold: optuna.pruners.NopPruner(),
+}
 
 
 class OptunaOptimizer:
@@ -25,11 +41,13 @@ class OptunaOptimizer:
         early_stopping_rounds: int = 30,
         is_stratified: bool = True,
         is_shuffle: bool = True,
+        early_stopping_size: float = 0.1,
     ):
         self.model = model
         self.data = data
         self.n_fold = n_fold
         self.early_stopping_rounds = early_stopping_rounds
+        self.early_stopping_size = early_stopping_size
         self.is_stratified = is_stratified
         self.is_shuffle = is_shuffle
 
@@ -86,17 +104,75 @@ class OptunaOptimizer:
 
         return param_grid
 
-    def _objective(self, trial: optuna.Trial, param_space: Dict, scoring: str):
+    def _objective(
+        self,
+        trial: optuna.Trial,
+        param_space: Dict,
+        scoring: str,
+        worker_params: Optional[Dict] = None,
+    ):
+        """
+        Cross validation score of the trial parameters. Folds are scored one at a time and
+        the running mean is reported after each fold, so the pruner of the study can stop
+        a hopeless trial early. Every fold fit stops early on an early_stopping_size split
+        held out of its training folds, so the validation fold scoring it stays unseen.
+        Estimators whose fit does not take eval_set and early_stopping_rounds are fitted
+        on the whole training folds without early stopping.
+        worker_params (e.g. the thread budget of a worker) are set on the fold models only.
+        """
         param_grid = OptunaOptimizer._construct_trial_grid(trial, param_space)
         self.model.set_params(**param_grid)
-        scores = cross_val_score(
-            self.model,
-            self.data[0],
-            self.data[1],
-            cv=self.cross_validation_split,
-            scoring=scoring,
-        )
-        return scores.mean()
+        scorer = get_scorer(scoring)
+        X, y = self.data
+
+        scores = []
+        for fold, (train_idx, val_idx) in enumerate(
+            self.cross_validation_split.split(X, y)
+        ):
+            X_train, y_train = X.iloc[train_idx], y.iloc[train_idx]
+            X_val, y_val = X.iloc[val_idx], y.iloc[val_idx]
+
+            model = clone(self.model).set_params(**(worker_params or {}))
+            fit_params = {}
+            if self.early_stopping_rounds and self._supports_early_stopping(model):
+                stratify = y_train if self.is_stratified else None
+                X_train, X_stop, y_train, y_stop = train_test_split(
+                    X_train,
+                    y_train,
+                    test_size=self.early_stopping_size,
+                    shuffle=self.is_shuffle or stratify is not None,
+                    stratify=stratify,
+                )
+                fit_params = {
+                    "eval_set": (X_stop, y_stop),
+                    "early_stopping_rounds": self.early_stopping_rounds,
+                }
+            model.fit(X_train, y_train, **fit_params)
+            scores.append(scorer(model, X_val, y_val))
+
+            trial.report(sum(scores) / len(scores), step=fold)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        return sum(scores) / len(scores)
+
+    @staticmethod
+    def _supports_early_stopping(model: Any) -> bool:
+        """
+        Whether the fit method of the model takes eval_set and early_stopping_rounds.
+        A fit only taking **kwargs is assumed to forward them to the fit of its base
+        class (e.g. CatBoostModel), so the base classes are checked in turn.
+        """
+        for cls in type(model).__mro__:
+            if "fit" not in vars(cls):
+                continue
+            parameters = inspect.signature(vars(cls)["fit"]).parameters
+            if "eval_set" in parameters and "early_stopping_rounds" in parameters:
+                return True
+            if not any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+                return False
+
+        return False
 
     def optimize(
         self,
@@ -106,20 +182,207 @@ class OptunaOptimizer:
         direction: str = "maximize",
         scoring="accuracy",
         log_verbose: str = "INFO",
+        n_jobs: int = 1,
+        storage: Optional[str] = None,
+        study_name: Optional[str] = None,
+        thread_param: Optional[str] = "thread_count",
+        pruner: Union[str, optuna.pruners.BasePruner] = "median",
     ):
+        """
+        Run the hyper-parameter search and return the best parameters found.
+        :param param_space: search space, see _construct_trial_grid - Dict
+        :param n_trials: total number of trials of the study. Parallel workers may finish up to
+        n_jobs - 1 trials more, as trials already running are completed - Optional[int]
+        :param timeout: time limit in seconds of every worker - Optional[int]
+        :param direction: direction of the optimization - str
+        :param scoring: sklearn scoring of the cross validation - str
+        :param log_verbose: optuna log level - str
+        :param n_jobs: number of trials run at once in worker processes - int
+        :param storage: database URL (e.g. sqlite:///study.db) or journal file path storing
+        the study - Optional[str]
+        :param study_name: name of the study in the storage. If storage or study_name is given,
+        the trials of an existing study with the same direction and parameters are resumed,
+        with the journal file <study_name>.log as default storage if n_jobs > 1. Otherwise a
+        new study with a unique name is run, in a temporary journal file if n_jobs > 1
+        - Optional[str]
+        :param thread_param: model parameter of its thread count. The cores of the machine are
+        split among the n_jobs trials through it, on the models of the trials only.
+        Not set if None - Optional[str]
+        :param pruner: pruner of the study, one of median, successive_halving, hyperband and
+        none or an optuna pruner - Union[str, optuna.pruners.BasePruner]
+        :return: best_params: the best parameters of the study - Dict
+        """
 
         if not n_trials and not timeout:
             raise ValueError("At least one of n_trials and timeout should be defined.")
 
         optuna.logging.set_verbosity(logging.getLevelName(log_verbose))
-        study = optuna.create_study(direction=direction)
+        if isinstance(pruner, str):
+            if pruner not in PRUNERS:
+                raise ValueError(
+                    f"Undefined pruner: {pruner}, available: {list(PRUNERS)}"
+                )
+            pruner = PRUNERS[pruner](self.n_fold)
+
+        # only a study named by the caller is resumed
+        resume = storage is not None or study_name is not None
+        temp_dir = None
+        if study_name is None:
+            study_name = f"movies_ds-{uuid.uuid4().hex}"
+        if n_jobs > 1 and storage is None:
+            if resume:
+                storage = f"{study_name}.log"
+            else:
+                temp_dir = tempfile.mkdtemp(prefix="movies_ds_")
+                storage = os.path.join(temp_dir, f"{study_name}.log")
+
+        try:
+            return self._optimize(
+                param_space,
+                n_trials,
+                timeout,
+                direction,
+                scoring,
+                n_jobs,
+                storage,
+                study_name,
+                thread_param,
+                pruner,
+                resume,
+            )
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _optimize(
+        self,
+        param_space: Dict,
+        n_trials: Optional[int],
+        timeout: Optional[int],
+        direction: str,
+        scoring: str,
+        n_jobs: int,
+        storage: Optional[str],
+        study_name: str,
+        thread_param: Optional[str],
+        pruner: optuna.pruners.BasePruner,
+        resume: bool,
+    ):
+        """Create or resume the study and run its trials in the current process or in workers"""
+        study = optuna.create_study(
+            storage=self._get_storage(storage),
+            study_name=study_name,
+            direction=direction,
+            pruner=pruner,
+            load_if_exists=resume,
+        )
+        finished = study.get_trials(states=(TrialState.COMPLETE, TrialState.PRUNED))
+        if finished:
+            self._check_resumed_study(study, param_space, direction)
+
+        # finished trials of a resumed study count in the total number of trials
+        if n_trials and len(finished) >= n_trials:
+            return study.best_params
+
+        worker_params = {}
+        if n_jobs > 1 and thread_param:
+            threads = max(1, multiprocessing.cpu_count() // n_jobs)
+            worker_params = {thread_param: threads}
+
+        args = (
+            param_space,
+            scoring,
+            storage,
+            study_name,
+            n_trials,
+            timeout,
+            pruner,
+            worker_params,
+        )
+        if n_jobs <= 1:
+            self._optimize_worker(*args, study=study)
+            return study.best_params
+
+        # fork so that the model and data are shared with the workers without pickling
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=self._optimize_worker, args=args)
+            for _ in range(n_jobs)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+
+        study = optuna.load_study(
+            study_name=study_name, storage=self._get_storage(storage)
+        )
+        return study.best_params
+
+    def _optimize_worker(
+        self,
+        param_space: Dict,
+        scoring: str,
+        storage: Optional[str],
+        study_name: str,
+        n_trials: Optional[int],
+        timeout: Optional[int],
+        pruner: optuna.pruners.BasePruner,
+        worker_params: Dict,
+        study: Optional[optuna.Study] = None,
+    ):
+        """Run trials of the shared study until n_trials are finished or timeout"""
+        if study is None:
+            study = optuna.load_study(
+                study_name=study_name,
+                storage=self._get_storage(storage),
+                pruner=pruner,
+            )
+
+        callbacks = []
+        if n_trials:
+            callbacks.append(
+                optuna.study.MaxTrialsCallback(
+                    n_trials, states=(TrialState.COMPLETE, TrialState.PRUNED)
+                )
+            )
         try:
             study.optimize(
-                lambda trial: self._objective(trial, param_space, scoring),
-                n_trials=n_trials,
+                lambda trial: self._objective(
+                    trial, param_space, scoring, worker_params
+                ),
                 timeout=timeout,
+                callbacks=callbacks,
             )
         except KeyboardInterrupt:
             pass
 
-        return study.best_params
+    @staticmethod
+    def _check_resumed_study(study: optuna.Study, param_space: Dict, direction: str):
+        """Raise a ValueError if a resumed study does not search the given space"""
+        if study.direction.name.lower() != direction.lower():
+            raise ValueError(
+                f"Study {study.study_name} is a {study.direction.name.lower()} study, "
+                f"cannot resume it to {direction}"
+            )
+
+        for trial in study.get_trials(states=(TrialState.COMPLETE, TrialState.PRUNED)):
+            if set(trial.params) != set(param_space):
+                raise ValueError(
+                    f"Study {study.study_name} searched the parameters {sorted(trial.params)}, "
+                    f"cannot resume it with {sorted(param_space)}"
+                )
+
+    @staticmethod
+    def _get_storage(
+        storage: Optional[str],
+    ) -> Optional[Union[str, optuna.storages.BaseStorage]]:
+        """Database URLs are given to optuna as they are, other paths are journal files"""
+        if storage is None or "://" in storage:
+            return storage
+
+        return JournalStorage(JournalFileBackend(storage))
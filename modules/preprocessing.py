@@ -1,5 +1,11 @@
+import timeit
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from modules.preprocessing.preprocessing import _explode_frame, iter_long_format
+
 
 # Data filling and merging operations
 def check_identical_df(df: pd.DataFrame, group_cols: list) -> bool:
@@ -7,29 +13,104 @@ def check_identical_df(df: pd.DataFrame, group_cols: list) -> bool:
     return df.groupby(group_cols).nunique(dropna=False).eq(1).all()
 
 
-def create_target_feature(df: pd.DataFrame):
-    """ Create target feature named movie_classification"""
+TARGET_LABELS = [
+    "super hit",
+    "blockbuster",
+    "minor success",
+    "flop",
+    "box office bomb",
+    "unclassified",
+]
+TARGET_THRESHOLDS = (4.5, 2.5, 1, 1 / 3)
+
+
+def _target_classification(
+    revenue, budget, thresholds: Tuple[float, ...] = TARGET_THRESHOLDS
+) -> str:
+    """Row-wise reference implementation of the movie classification"""
+    super_hit, blockbuster, success, flop = thresholds
+    if revenue == 0 or budget == 0:
+        return "unclassified"
+
+    if revenue >= super_hit * budget:
+        return "super hit"
+    if super_hit * budget >= revenue >= blockbuster * budget:
+        return "blockbuster"
+    if blockbuster * budget >= revenue >= success * budget:
+        return "minor success"
+    if success * budget >= revenue >= flop * budget:
+        return "flop"
+    if flop * budget >= revenue:
+        return "box office bomb"
+
 
-    def target_classification(revenue, budget) -> str:
-        if revenue == 0 or budget == 0:
-            return "unclassified"
+def classify_revenue(
+    revenue, budget, thresholds: Tuple[float, ...] = TARGET_THRESHOLDS
+) -> pd.Categorical:
+    """Vectorized movie classification from revenue and budget arrays.
 
-        if revenue >= 4.5 * budget:
-            return "super hit"
-        if 4.5 * budget >= revenue >= 2.5 * budget:
-            return "blockbuster"
-        if 2.5 * budget >= revenue >= budget:
-            return "minor success"
-        if budget >= revenue >= 1 / 3 * budget:
-            return "flop"
-        if 1 / 3 * budget >= revenue:
-            return "box office bomb"
+    Every class boundary is evaluated once over the whole arrays and the labels are
+    assigned in one pass with ``np.select``. Boundaries are compared against the
+    scaled budget (not a revenue/budget ratio) so the result is identical to
+    ``_target_classification``, including ties and rows with NaN (left missing).
+    """
+    if len(thresholds) != 4 or list(thresholds) != sorted(thresholds, reverse=True):
+        raise ValueError(
+            f"thresholds must be 4 values in descending order, got {thresholds}"
+        )
+
+    revenue = pd.Series(revenue).to_numpy(dtype="float64", na_value=np.nan)
+    budget = pd.Series(budget).to_numpy(dtype="float64", na_value=np.nan)
+    super_hit, blockbuster, success, flop = (t * budget for t in thresholds)
+
+    with np.errstate(invalid="ignore"):
+        conditions = [
+            (revenue == 0) | (budget == 0),
+            revenue >= super_hit,
+            (super_hit >= revenue) & (revenue >= blockbuster),
+            (blockbuster >= revenue) & (revenue >= success),
+            (success >= revenue) & (revenue >= flop),
+            flop >= revenue,
+        ]
+    codes = np.select(conditions, [5, 0, 1, 2, 3, 4], default=-1)
+    return pd.Categorical.from_codes(codes, categories=TARGET_LABELS)
 
-    df["movie_classification"] = df.apply(
-        lambda row: target_classification(row["revenue"], row["budget"]), axis=1
+
+def create_target_feature(
+    df: pd.DataFrame, thresholds: Tuple[float, ...] = TARGET_THRESHOLDS
+):
+    """Create categorical target feature named movie_classification"""
+    df["movie_classification"] = classify_revenue(
+        df["revenue"], df["budget"], thresholds
     )
 
 
+def benchmark_target_feature(df: pd.DataFrame, repeat: int = 3) -> dict:
+    """Time the vectorized target labelling against the former row-wise ``apply``
+    path on the given dataframe and check both produce the same labels"""
+
+    def apply_path():
+        return df.apply(
+            lambda row: _target_classification(row["revenue"], row["budget"]), axis=1
+        )
+
+    def vectorized_path():
+        return classify_revenue(df["revenue"], df["budget"])
+
+    timings = {}
+    for name, func in [("apply", apply_path), ("vectorized", vectorized_path)]:
+        timings[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+
+    expected, result = apply_path(), vectorized_path()
+    assert (
+        pd.Series(result, index=df.index).astype(object).fillna("<NA>")
+        == expected.astype(object).fillna("<NA>")
+    ).all(), "Vectorized labels differ from the apply path"
+
+    timings["speedup"] = timings["apply"] / timings["vectorized"]
+    return timings
+
+
 def print_stats(df, budget_col="budget", revenue_col="revenue"):
     """ Print several statistics and nan values of given dataset"""
     len_df = len(df)
@@ -45,35 +126,18 @@ def print_stats(df, budget_col="budget", revenue_col="revenue"):
 
 
 def list_column_to_long_format(
-    dataframe: pd.DataFrame, column: str, delimiter: str = ","
-) -> pd.DataFrame:
+    dataframe: pd.DataFrame,
+    column: str,
+    delimiter: str = ",",
+    chunk_size: Optional[int] = None,
+) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
     """Returns a dataframe where values in column are not delimiter-separated lists 
-    anymore but one per row, with all other information duplicated on multiple rows"""
+    anymore but one per row, with all other information duplicated on multiple rows.
+    Values of the same original row are kept next to each other.
+    If chunk_size is given, an iterator over long format batches is returned instead"""
     assert column in dataframe.columns, "Column must be in dataframe"
 
-    # Expand Series of column to DataFrame and add index as id for merging afterwards
-    splitted_columns = dataframe[column].str.split(delimiter, expand=True).reset_index()
+    if chunk_size is not None:
+        return iter_long_format(dataframe, column, delimiter, chunk_size)
 
-    # Convert from wide format to long format and drop NAs
-    long_format = (
-        pd.melt(
-            splitted_columns,
-            id_vars="index",
-            value_vars=splitted_columns.drop(columns="index").columns,
-            value_name=column,
-        )
-        .drop(columns="variable")
-        .dropna()
-    )
-
-    # Strip all values
-    long_format[column] = long_format[column].str.strip()
-
-    # Merge dataframe
-    merged_df = pd.merge(
-        long_format,
-        dataframe.drop(columns=column).reset_index(),
-        on="index",
-        how="inner",
-    )
-    return merged_df.drop(columns="index")
+    return _explode_frame(dataframe, column, delimiter)
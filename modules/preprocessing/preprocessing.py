@@ -1,10 +1,153 @@
-from typing import Any, Dict, List, Optional
-
+import hashlib
+import itertools
+import json
+import os
+import re
+import tracemalloc
+import warnings
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pandas.api.types import is_object_dtype, is_string_dtype
+from pyarrow import feather
+from scipy import sparse
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import murmurhash3_32
 from sklearn.utils.validation import check_is_fitted
 
 
+def merge_text_columns(
+    X: pd.DataFrame, columns: List[str], na_as_text: bool = True
+) -> pd.Series:
+    """
+    Merge text columns into one with column-wise string operations. Columns are merged
+    from left to right: a value equal to the merged text so far is not repeated, other
+    values are appended separated by a space. The result is stripped.
+    :param X: dataframe containing the text columns - Dataframe
+    :param columns: names of the text columns to merge, in order - List[str]
+    :param na_as_text: if set, missing values are merged as their string representation
+    ("nan", "<NA>") exactly as the former row-wise merge did, otherwise they are skipped
+    and rows missing in every column stay missing - bool
+    :return: merged: the merged text column - Series
+    """
+    merged = X[columns[0]].astype(object)
+    for column in columns[1:]:
+        other = X[column].astype(object)
+        if na_as_text:
+            merged_text, other_text = merged.astype(str), other.astype(str)
+            merged = merged.where(
+                merged_text == other_text, merged_text + " " + other_text
+            )
+        else:
+            merged_text = merged.fillna("").astype(str)
+            other_text = other.fillna("").astype(str)
+            merged_text = merged_text.where(
+                (merged_text == other_text) | (other_text == ""),
+                (merged_text + " " + other_text).where(merged_text != "", other_text),
+            )
+            merged = merged_text.where(merged.notna() | other.notna())
+
+    return merged.str.strip()
+
+
+class FeatherCache:
+    """
+    On-disk cache of preprocessed (X, y) pairs stored as uncompressed Feather files,
+    so a hit skips decompression: the file is memory-mapped and copied once into the
+    returned pandas objects. Least recently used entries are evicted once the cache
+    directory grows above max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024**3) -> None:
+        """
+        Constructor for the cache.
+        :param cache_dir: directory of the cached files, created on the first put - str
+        :param max_bytes: size of the cache directory above which entries are evicted - int
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(
+        X: pd.DataFrame, params: Dict[str, Any], source_path: Optional[str] = None
+    ) -> str:
+        """
+        Fingerprint of the input and the parameters transforming it.
+        :param X: input dataframe - Dataframe
+        :param params: parameters changing the output - Dict[str, Any]
+        :param source_path: if given, the path and modification time of this file are used
+        instead of hashing the content of X - Optional[str]
+        :return: key: hex digest - str
+        """
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+        if source_path is not None:
+            stat = os.stat(source_path)
+            source = f"{os.path.abspath(source_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+            digest.update(source.encode())
+        else:
+            digest.update(str(list(zip(X.columns, X.dtypes.astype(str)))).encode())
+            digest.update(pd.util.hash_pandas_object(X, index=True).to_numpy())
+
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[pd.DataFrame, pd.Series]]:
+        """
+        Returns the cached (X, y) pair of the key or None if not cached. The file is
+        memory-mapped and converted to pandas, which copies the data into memory.
+        """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+
+        table = feather.read_table(path, memory_map=True)
+        target_col = table.schema.metadata[b"target_col"].decode()
+        X = table.drop([target_col]).to_pandas()
+        y = table.column(target_col).to_pandas()
+        y.index, y.name = X.index, target_col
+
+        # refresh access time for LRU eviction
+        os.utime(path)
+        return X, y
+
+    def put(self, key: str, X: pd.DataFrame, y: pd.Series):
+        """Store the (X, y) pair under the key and evict old entries if needed"""
+        try:
+            table = pa.Table.from_pandas(X, preserve_index=True)
+            table = table.append_column(y.name, pa.Array.from_pandas(y))
+        except (pa.ArrowException, ValueError) as e:
+            warnings.warn(f"Preprocessed data cannot be cached: {e}")
+            return
+
+        metadata = {**table.schema.metadata, b"target_col": str(y.name).encode()}
+        table = table.replace_schema_metadata(metadata)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to a temporary file first so readers never see a partial file
+        tmp_path = self._path(key) + ".tmp"
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.feather")
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".feather")
+        ]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        total = 0
+        for i, entry in enumerate(entries):
+            total += entry.stat().st_size
+            # always keep the most recent entry
+            if total > self.max_bytes and i > 0:
+                os.remove(entry.path)
+
+
 class BaselinePreprocessor(BaseEstimator, TransformerMixin):
     """
     Base processor for movies classification
@@ -16,8 +159,14 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
         na_cols: Optional[List[str]] = None,
         target_col: str = "movie_classification",
         merge_descr: bool = True,
+        merge_cols: Optional[List[str]] = None,
+        merge_na_as_text: bool = True,
         drop_na_rows: bool = True,
         drop_by_target: bool = True,
+        low_memory: bool = False,
+        track_memory: bool = False,
+        cache_dir: Optional[str] = None,
+        cache_max_bytes: int = 2 * 1024**3,
     ):
         """
         Init method for processor.
@@ -27,8 +176,19 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
         :param target_col: target column for movie classification. will use if drop_by_target is True
         and target series selection- str
         :param merge_descr: merge two description columns into one if set - bool
+        :param merge_cols: text columns merged into the first one when merge_descr is set.
+        Defaults to description and description2 if None - Optional[List[str]]
+        :param merge_na_as_text: merge missing values as their string representation ("nan")
+        like the original row-wise merge did. Missing values are skipped if not set - bool
         :param drop_na_rows: drop rows with any na column if set - bool
         :param drop_by_target: drop rows with target label 'unclassified' if set - bool
+        :param low_memory: build the output with a single row and column selection instead of
+        copying the whole input and filtering it step by step - bool
+        :param track_memory: record the peak memory allocated by transform in peak_memory_ - bool
+        :param cache_dir: directory where fit_transform results are cached as Feather files.
+        No caching if None - Optional[str]
+        :param cache_max_bytes: size of the cache directory above which least recently used
+        results are evicted - int
         :return: self: the class object - an instance of the transformer - Transformer
         """
         # if the columns parameter is not a list, make it into a list
@@ -42,8 +202,14 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
         self.na_cols_ = na_cols
         self.target_col_ = target_col
         self.merge_descr_ = merge_descr
+        self.merge_cols_ = merge_cols or ["description", "description2"]
+        self.merge_na_as_text_ = merge_na_as_text
         self.drop_na_rows_ = drop_na_rows
         self.drop_by_target_ = drop_by_target
+        self.low_memory_ = low_memory
+        self.track_memory_ = track_memory
+        self.cache_dir_ = cache_dir
+        self.cache_max_bytes_ = cache_max_bytes
 
     def fit(self, X: pd.DataFrame, y=None):
         """
@@ -64,6 +230,24 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
         :returns: ``pd.DataFrame`` and ``pd.Series`` for training dataframe and target series
         """
         check_is_fitted(self)
+        transform = self._transform_low_memory if self.low_memory_ else self._transform
+
+        if not self.track_memory_:
+            return transform(X)
+
+        is_tracing = tracemalloc.is_tracing()
+        if not is_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            return transform(X)
+        finally:
+            self.peak_memory_ = tracemalloc.get_traced_memory()[1]
+            if not is_tracing:
+                tracemalloc.stop()
+
+    def _transform(self, X: pd.DataFrame) -> (pd.DataFrame, pd.Series):
+        """Transformation working on a copy of the input, filtered step by step"""
         X = X.copy()
 
         # first drop redundant columns
@@ -75,16 +259,12 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
             X = self._fill_na(X)
 
         # third merge description columns if needed
-        check_col_exist_ = (col in X.columns for col in ["description", "description2"])
+        check_col_exist_ = (col in X.columns for col in self.merge_cols_)
         if self.merge_descr_ and all(check_col_exist_):
-            X["description"] = X.apply(
-                lambda x: x["description"]
-                if str(x["description"]) == str(x["description2"])
-                else str(x["description"]) + " " + str(x["description2"]),
-                axis=1,
+            X[self.merge_cols_[0]] = merge_text_columns(
+                X, self.merge_cols_, self.merge_na_as_text_
             )
-            X["description"] = X["description"].str.strip()
-            X = X.drop(columns="description2")
+            X = X.drop(columns=self.merge_cols_[1:])
 
         # forth drop any row with na values after filling if needed
         if self.drop_na_rows_:
@@ -100,6 +280,61 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
 
         return X, y
 
+    def _transform_low_memory(self, X: pd.DataFrame) -> (pd.DataFrame, pd.Series):
+        """
+        Same transformation as _transform but without intermediate copies of the input:
+        one combined row mask and one column selection are computed up front, the output
+        is taken once and NA values are filled in place on the selected columns only
+        """
+        if self.na_cols_:
+            self._check_na_cols(X)
+
+        columns = [col for col in X.columns if col not in self.drop_cols_]
+        merge_descr = self.merge_descr_ and all(
+            col in columns for col in self.merge_cols_
+        )
+        if merge_descr:
+            columns = [col for col in columns if col not in self.merge_cols_[1:]]
+        na_cols = [col for col in self.na_cols_ if col in columns]
+
+        # combined mask of non na rows and classified targets
+        mask = np.ones(len(X), dtype=bool)
+        if self.drop_na_rows_:
+            for col in columns:
+                # filled and merged columns are checked after filling and merging
+                if col in na_cols or (merge_descr and col == self.merge_cols_[0]):
+                    continue
+                mask &= X[col].notna().to_numpy()
+
+        if self.drop_by_target_:
+            mask &= (X[self.target_col_] != "unclassified").to_numpy()
+
+        # merge text columns of the remaining rows only
+        merged = None
+        if merge_descr:
+            rows = np.flatnonzero(mask)
+            source = X.iloc[rows, X.columns.get_indexer(self.merge_cols_)]
+            source.fillna(
+                {col: "" for col in self.merge_cols_ if col in self.na_cols_},
+                inplace=True,
+            )
+            merged = merge_text_columns(
+                source, self.merge_cols_, self.merge_na_as_text_
+            )
+            if self.drop_na_rows_:
+                mask[rows[merged.isna().to_numpy()]] = False
+                merged = merged[merged.notna()]
+
+        # materialize the output in a single take
+        X = X.iloc[np.flatnonzero(mask), X.columns.get_indexer(columns)]
+        if merged is not None:
+            X[self.merge_cols_[0]] = merged.to_numpy()
+        if na_cols:
+            X.fillna({col: "" for col in na_cols}, inplace=True)
+
+        y = X.pop(self.target_col_)
+        return X, y
+
     def fit_transform(
         self, X: pd.DataFrame, y=None, **kwargs: Dict
     ) -> (pd.DataFrame, pd.Series):
@@ -107,16 +342,52 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
         perform fit and transform over the data
         :param X: dataframe will be transformed - Dataframe
         :param y: target vector - Series
-        :param kwargs: free parameters - dictionary
+        :param kwargs: free parameters - dictionary. If cache_dir is set, source_path can be
+        given to key the cache on the path and modification time of the file X was read
+        from instead of hashing the content of X
         :returns: ``pd.DataFrame`` and ``pd.Series`` for training dataframe and target series
         """
         self_ = self.fit(X, y)
-        return self_.transform(X)
+        if self.cache_dir_ is None:
+            return self_.transform(X)
+
+        cache = FeatherCache(self.cache_dir_, self.cache_max_bytes_)
+        key = cache.key(X, self._cache_params(), kwargs.get("source_path"))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        X, y = self_.transform(X)
+        cache.put(key, X, y)
+        return X, y
+
+    def _cache_params(self) -> Dict[str, Any]:
+        """Parameters changing the output of transform, used in the cache key"""
+        return {
+            "drop_cols": self.drop_cols_,
+            "na_cols": self.na_cols_,
+            "target_col": self.target_col_,
+            "merge_descr": self.merge_descr_,
+            "merge_cols": self.merge_cols_,
+            "merge_na_as_text": self.merge_na_as_text_,
+            "drop_na_rows": self.drop_na_rows_,
+            "drop_by_target": self.drop_by_target_,
+        }
 
     @staticmethod
     def update_features(X: pd.DataFrame, col_list: List[str]) -> List[str]:
         return [col for col in col_list if col in X.columns]
 
+    def _check_na_cols(self, X: pd.DataFrame):
+        """Check that the columns filled with empty string are in a string dtype"""
+        for feature in self.na_cols_:
+            if not (
+                is_object_dtype(X[feature].dtype) or is_string_dtype(X[feature].dtype)
+            ):
+                raise KeyError(
+                    f"{feature} is given but the type of column is not one of the string dtype"
+                )
+
     def _fill_na(self, X: pd.DataFrame) -> pd.DataFrame:
         """Fill na rows for given columns with empty string in the input DataFrame"""
         # check whether filling columns in text format
@@ -156,21 +427,77 @@ class BaselinePreprocessor(BaseEstimator, TransformerMixin):
             )
 
 
+def _explode_offsets(
+    values: pd.Series, delimiter: str = ","
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Split delimiter-separated strings into per-row list lengths and one flat array
+    of stripped values. Missing or non-string values get a length of 0"""
+    splitted = values.str.split(delimiter)
+    lengths = splitted.str.len().fillna(0).to_numpy(dtype="int64")
+    flat = np.fromiter(
+        itertools.chain.from_iterable(splitted[lengths > 0]),
+        dtype=object,
+        count=lengths.sum(),
+    )
+    return lengths, pd.Series(flat, dtype=object).str.strip().to_numpy()
+
+
+def _explode_frame(X: pd.DataFrame, column: str, delimiter: str = ",") -> pd.DataFrame:
+    """Long format of the given frame built from offsets: parent rows are repeated by
+    their list lengths with ``np.repeat`` and taken once, without any join"""
+    lengths, flat = _explode_offsets(X[column], delimiter)
+    parents = np.repeat(np.arange(len(X)), lengths)
+    other_cols = [i for i, col in enumerate(X.columns) if col != column]
+
+    long_format = X.iloc[parents, other_cols].reset_index(drop=True)
+    long_format.insert(0, column, flat)
+    return long_format
+
+
+def iter_long_format(
+    X: pd.DataFrame, column: str, delimiter: str = ",", chunk_size: int = 100_000
+) -> Iterator[pd.DataFrame]:
+    """Yields the long format of X in batches of about chunk_size rows, so peak memory
+    is bounded by the chunk size instead of the whole exploded frame. A single list
+    longer than chunk_size makes up a batch alone"""
+    assert column in X.columns, "Column must be in dataframe"
+    assert chunk_size > 0, "chunk_size must be positive"
+
+    # list lengths are known from delimiter counts without splitting anything yet
+    # a single character delimiter is taken literally by str.split, longer ones as regex
+    pattern = re.escape(delimiter) if len(delimiter) == 1 else delimiter
+    counts = X[column].str.count(pattern) + 1
+    ends = np.cumsum(counts.fillna(0).to_numpy(dtype="int64"))
+
+    start = 0
+    while start < len(X):
+        offset = ends[start - 1] if start > 0 else 0
+        stop = max(np.searchsorted(ends, offset + chunk_size, side="right"), start + 1)
+        # skip batches without any list value to explode
+        if ends[stop - 1] > offset:
+            yield _explode_frame(X.iloc[start:stop], column, delimiter)
+        start = stop
+
+
 class ToWideTransformer(BaseEstimator, TransformerMixin):
     """
     Returns a dataframe where values in column are not delimiter-separated lists
     anymore but one per row, with all other information duplicated on multiple rows
     """
 
-    def __init__(self, column: str, delimiter: str = ",") -> None:
+    def __init__(
+        self, column: str, delimiter: str = ",", chunk_size: int = 100_000
+    ) -> None:
         """
         Constructor for the transformer.
         :param column: column name will be used for transformation - str
         :param delimiter: delimiter used for column value splitting - str
+        :param chunk_size: approximate number of output rows per batch of transform_chunks - int
         """
         super(ToWideTransformer, self).__init__()
         self.column = column
         self.delimiter = delimiter
+        self.chunk_size = chunk_size
 
     def fit(self, X: pd.DataFrame, y=None, **kwargs: Dict):
         """
@@ -185,38 +512,22 @@ class ToWideTransformer(BaseEstimator, TransformerMixin):
 
     def transform(self, X: pd.DataFrame) -> pd.DataFrame:
         """
-        Transform tight format to wide format for a column.
+        Transform tight format to wide format for a column. Values coming from the same
+        original row are kept next to each other.
         :param X: dataframe will be transformed - Dataframe
         :return: X: the transformed data - Dataframe
         """
-        # Expand Series of column to DataFrame and add index as id for merging afterwards
-        splitted_columns = (
-            X[self.column].str.split(self.delimiter, expand=True).reset_index()
-        )
-
-        # Convert from wide format to long format and drop NAs
-        long_format = (
-            pd.melt(
-                splitted_columns,
-                id_vars="index",
-                value_vars=splitted_columns.drop(columns="index").columns,
-                value_name=self.column,
-            )
-            .drop(columns="variable")
-            .dropna()
-        )
+        return _explode_frame(X, self.column, self.delimiter)
 
-        # Strip all values
-        long_format[self.column] = long_format[self.column].str.strip()
-
-        # Merge dataframe
-        merged_df = pd.merge(
-            long_format,
-            X.drop(columns=self.column).reset_index(),
-            on="index",
-            how="inner",
-        )
-        return merged_df.drop(columns="index")
+    def transform_chunks(self, X: pd.DataFrame) -> Iterator[pd.DataFrame]:
+        """
+        Same as transform but yields the result in batches of about chunk_size rows,
+        so peak memory is bounded by the chunk size instead of the whole exploded frame.
+        A single list longer than chunk_size makes up a batch alone.
+        :param X: dataframe will be transformed - Dataframe
+        :return: batches of the transformed data - Iterator[Dataframe]
+        """
+        return iter_long_format(X, self.column, self.delimiter, self.chunk_size)
 
     def fit_transform(self, X: pd.DataFrame, y=None, **kwargs: Dict) -> pd.DataFrame:
         """
@@ -228,3 +539,110 @@ class ToWideTransformer(BaseEstimator, TransformerMixin):
         """
         self_ = self.fit(X, y)
         return self_.transform(X)
+
+
+class MultiHotEncoder(BaseEstimator, TransformerMixin):
+    """
+    Encodes delimiter-separated list columns (genres, cast, keywords...) as a sparse
+    multi-hot matrix with one column per known value, without exploding any row
+    """
+
+    def __init__(
+        self,
+        columns: List[str],
+        delimiter: str = ",",
+        min_frequency: int = 1,
+        n_features: Optional[int] = None,
+    ) -> None:
+        """
+        Constructor for the encoder.
+        :param columns: list columns will be encoded - List[str]
+        :param delimiter: delimiter used for column value splitting - str
+        :param min_frequency: values seen less than this number of times during fit are
+        dropped from the vocabulary - int
+        :param n_features: if given, values are hashed into this many features per column
+        instead of using a fitted vocabulary, so unseen values are encoded too - Optional[int]
+        """
+        super(MultiHotEncoder, self).__init__()
+        self.columns = columns
+        self.delimiter = delimiter
+        self.min_frequency = min_frequency
+        self.n_features = n_features
+
+    def fit(self, X: pd.DataFrame, y=None, **kwargs: Dict):
+        """
+        Method to check columns and build the vocabulary of every column.
+        :param X: dataframe will be transformed - Dataframe
+        :param y: target vector - Series
+        :param kwargs: free parameters - dictionary
+        :return: self: the class object - an instance of the transformer - Transformer
+        """
+        non_existent_columns = set(self.columns).difference(X.columns)
+        if len(non_existent_columns) > 0:
+            raise KeyError(f"{list(non_existent_columns)} column(s) not in DataFrame")
+
+        self.vocabulary_ = {}
+        for column in self.columns:
+            if self.n_features:
+                self.vocabulary_[column] = pd.Index(
+                    [f"hash{i}" for i in range(self.n_features)]
+                )
+                continue
+
+            _, flat = _explode_offsets(X[column], self.delimiter)
+            counts = pd.Series(flat[flat != ""]).value_counts()
+            self.vocabulary_[column] = counts.index[
+                counts >= self.min_frequency
+            ].sort_values()
+
+        return self
+
+    def transform(self, X: pd.DataFrame) -> sparse.csr_matrix:
+        """
+        Encode the list columns as one multi-hot block per column, stacked horizontally.
+        Values not in the vocabulary are ignored.
+        :param X: dataframe will be transformed - Dataframe
+        :return: X: the encoded data - csr_matrix
+        """
+        check_is_fitted(self)
+        blocks = [self._encode_column(X[column], column) for column in self.columns]
+        return sparse.hstack(blocks, format="csr")
+
+    def get_feature_names_out(self, input_features=None) -> np.ndarray:
+        """Returns feature names as column=value (or column=hashN in hashing mode)"""
+        check_is_fitted(self)
+        return np.array(
+            [
+                f"{column}={value}"
+                for column in self.columns
+                for value in self.vocabulary_[column]
+            ],
+            dtype=object,
+        )
+
+    def _encode_column(self, values: pd.Series, column: str) -> sparse.csr_matrix:
+        """Build the multi-hot block of a single column in O(nnz) memory"""
+        lengths, flat = _explode_offsets(values, self.delimiter)
+        rows = np.repeat(np.arange(len(values)), lengths)
+        n_cols = len(self.vocabulary_[column])
+
+        if self.n_features:
+            cols = np.fromiter(
+                (murmurhash3_32(value, positive=True) for value in flat),
+                dtype="int64",
+                count=len(flat),
+            )
+            cols %= self.n_features
+        else:
+            cols = pd.Categorical(flat, categories=self.vocabulary_[column]).codes
+
+        # drop empty and unknown values
+        mask = (flat != "") & (cols >= 0)
+        block = sparse.csr_matrix(
+            (np.ones(mask.sum()), (rows[mask], cols[mask])),
+            shape=(len(values), n_cols),
+        )
+        # a value repeated in the same row is still a single hot
+        block.sum_duplicates()
+        block.data[:] = 1
+        return block
@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+
+import requests
+from scrapy.http import HtmlResponse, Request
+
+from movie_scrapers.scrapers.spiders.boxoffice_spider import BoxOfficeSpider
+
+# saved title credits pages (<imdb id>.html files) the parse engines are compared on
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "boxoffice_mojo")
+PARSE_ENGINES = ("bs4", "selector")
+
+
+def load_fixture_pages(fixture_dir=FIXTURE_DIR):
+    """Load the title credits pages of the fixture directory as responses"""
+    pages = []
+    for name in sorted(os.listdir(fixture_dir)):
+        if name.endswith(".html"):
+            with open(os.path.join(fixture_dir, name), "rb") as page:
+                imdb_id = name[: -len(".html")]
+                url = BoxOfficeSpider.start_urls[0] + imdb_id + "/credits/"
+                pages.append(
+                    HtmlResponse(
+                        url=url,
+                        body=page.read(),
+                        encoding="utf-8",
+                        request=Request(url, meta={"imdb_id": imdb_id}),
+                    )
+                )
+
+    return pages
+
+
+def extract_items(pages, engine):
+    """Items extracted from the pages with the given parse engine"""
+    # a new response each time, response.text and selectors are cached
+    return [
+        dict(
+            BoxOfficeSpider.extract_item(
+                response.replace().text, response.meta["imdb_id"], engine
+            )
+        )
+        for response in pages
+    ]
+
+
+def check_parse_engines(fixture_dir=FIXTURE_DIR):
+    """Assert that all the parse engines extract the same items from the fixture pages"""
+    pages = load_fixture_pages(fixture_dir)
+    assert pages, f"No fixture pages in {fixture_dir}"
+
+    expected = extract_items(pages, PARSE_ENGINES[0])
+    for engine in PARSE_ENGINES[1:]:
+        different = [
+            response.meta["imdb_id"]
+            for response, item, expected_item in zip(
+                pages, extract_items(pages, engine), expected
+            )
+            if item != expected_item
+        ]
+        assert (
+            not different
+        ), f"{engine} and {PARSE_ENGINES[0]} items differ for pages: {different}"
+
+
+def benchmark_parse_engines(fixture_dir=FIXTURE_DIR, repeat=3):
+    """
+    Benchmark the parse engines over the fixture pages (see save_fixture_pages), after
+    checking that they extract the same items. Returns the pages parsed per second by engine.
+    """
+    check_parse_engines(fixture_dir)
+    pages = load_fixture_pages(fixture_dir)
+
+    results = {}
+    for engine in PARSE_ENGINES:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            extract_items(pages, engine)
+        results[engine] = len(pages) * repeat / (time.perf_counter() - started)
+
+    return results
+
+
+def save_fixture_pages(imdb_ids, fixture_dir=FIXTURE_DIR):
+    """Save the title credits pages of the given movies as fixtures of the benchmark"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    for imdb_id in imdb_ids:
+        url = BoxOfficeSpider.start_urls[0] + str(imdb_id) + "/credits/"
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(fixture_dir, f"{imdb_id}.html"), "wb") as page:
+            page.write(response.content)
+
+
+def main():
+    my_parser = argparse.ArgumentParser(
+        prog="benchmark_boxoffice",
+        description="Check and benchmark the parse engines of the Boxoffice mojo spider",
+        allow_abbrev=False,
+    )
+    my_parser.add_argument(
+        "-f",
+        "--fixture_dir",
+        default=FIXTURE_DIR,
+        help="Directory of the saved title credits pages",
+    )
+    my_parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Number of parses of every page"
+    )
+    my_parser.add_argument(
+        "-s",
+        "--save",
+        nargs="+",
+        metavar="IMDB_ID",
+        help="Save the pages of the given movies to the fixture directory first",
+    )
+    args = my_parser.parse_args()
+
+    if args.save:
+        save_fixture_pages(args.save, args.fixture_dir)
+    for engine, pages_per_second in benchmark_parse_engines(
+        args.fixture_dir, args.repeat
+    ).items():
+        print(f"{engine}: {pages_per_second:.0f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,7 @@ def main():
         s["DOWNLOADER_MIDDLEWARES"] = {
             "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
             "scrapers.middlewares.CustomRotatingProxiesMiddleware": 610,
+            "scrapers.middlewares.AdaptiveConcurrencyMiddleware": 615,
             "rotating_proxies.middlewares.BanDetectionMiddleware": 620,
         }
     elif args.use_ua:
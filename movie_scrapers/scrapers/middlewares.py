@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 """
 This file include custom middleware for scrapy.
-The middleware implements rotating proxy with random user agent.
+The middleware implements rotating proxy with random user agent,
+and adaptive concurrency of the proxies.
 """
 import asyncio
 import codecs
@@ -9,7 +10,9 @@ import json
 import logging
 import os
 import threading
+from collections import deque
 from subprocess import CalledProcessError, check_call
+from time import monotonic
 
 from fake_useragent import UserAgent
 from proxybroker import Broker
@@ -59,6 +62,8 @@ class CustomRotatingProxiesMiddleware(RotatingProxyMiddleware):
         self.proxies = CustomProxies(
             self.cleanup_proxy_list(proxy_list), backoff=self.proxies.backoff
         )
+        self.crawler = crawler
+        self.proxy_choices = crawler.settings.getint("ROTATING_PROXY_CHOICES", 4)
         # if we need to use random agent, set it up
         self.use_random_ua = crawler.settings.get("USE_RANDOM_UA", False)
         if self.use_random_ua:
@@ -92,7 +97,7 @@ class CustomRotatingProxiesMiddleware(RotatingProxyMiddleware):
         if "proxy" in request.meta and not request.meta.get("_rotating_proxy"):
             return
         # first setup proxy
-        proxy = self.proxies.get_random()
+        proxy = self.get_proxy()
         if not proxy:
             if self.stop_if_no_proxies:
                 raise CloseSpider("no_proxies")
@@ -117,6 +122,34 @@ class CustomRotatingProxiesMiddleware(RotatingProxyMiddleware):
         # then setup user agent
         self.setup_ua(request)
 
+    def get_proxy(self):
+        """Get a random proxy whose slot has free capacity, out of at most
+        ROTATING_PROXY_CHOICES random ones, or the one with the most free capacity among them.
+        Requests then follow the concurrency of each proxy slot (see
+        AdaptiveConcurrencyMiddleware) instead of queuing behind throttled proxies.
+        """
+        best, best_capacity = None, None
+        for _ in range(self.proxy_choices):
+            proxy = self.proxies.get_random()
+            if proxy is None:
+                break
+            capacity = self.get_free_capacity(proxy)
+            if capacity > 0:
+                return proxy
+            if best is None or capacity > best_capacity:
+                best, best_capacity = proxy, capacity
+
+        return best
+
+    def get_free_capacity(self, proxy):
+        """Number of requests the download slot of the proxy can still send at once,
+        a slot throttled with a download delay sends a single one
+        """
+        slot = self.crawler.engine.downloader.slots.get(self.get_proxy_slot(proxy))
+        if slot is None:
+            return self.crawler.settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN", 8)
+        return (1 if slot.delay else slot.concurrency) - len(slot.active)
+
     def reanimate_proxies(self):
         """Prevent dead proxies from reanimating.
         If reanimation is needed, just comment it out this overriding
@@ -449,3 +482,201 @@ class CustomProxies(Proxies):
         self.proxies[proxy] = ProxyState()
         self.proxies_by_hostport[hostport] = proxy
         self.unchecked.add(proxy)
+
+
+class SlotStats:
+    """
+    Helper class tracking the latency and the outcome of the last responses of a download slot.
+    """
+
+    def __init__(self, window, concurrency=1, alpha=0.3):
+        self.outcomes = deque(maxlen=window)
+        self.alpha = alpha
+        self.latency = None
+        # learned concurrency and delay, and the downloader slot they are applied to
+        self.concurrency = concurrency
+        self.delay = 0
+        self.slot = None
+        # responses since the last concurrency change and its time
+        self.since_change = 0
+        self.changed_at = monotonic()
+
+    def record(self, error, latency=None):
+        """Record the outcome of a response and update the moving average of the latency"""
+        self.outcomes.append(error)
+        self.since_change += 1
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = self.alpha * latency + (1 - self.alpha) * self.latency
+
+    @property
+    def error_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def changed(self):
+        self.since_change = 0
+        self.changed_at = monotonic()
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Downloader middleware adapting the concurrency of each download slot (one per proxy, see
+    CustomRotatingProxiesMiddleware) and the global concurrency to how the slots behave.
+
+    A slot whose responses are healthy and faster than the target latency gets one more
+    concurrent request every `concurrency` responses, a slow slot loses one down to a single
+    request and an error (ban, error status or download exception) halves it. A slot erring
+    with a single request is then throttled with a download delay instead, which successful
+    responses halve back to zero.
+    The global concurrency grows while the downloader is saturated and the error rate over the
+    last responses is below the threshold, and is halved (not below CONCURRENT_REQUESTS) above it.
+    Slots start with ADAPTIVE_CONCURRENCY_SLOT_START concurrent requests instead of
+    CONCURRENT_REQUESTS_PER_DOMAIN, and slots recreated after being idle with what they learned.
+    """
+
+    def __init__(self, crawler):
+        s = crawler.settings
+        self.crawler = crawler
+        self.window = s.getint("ADAPTIVE_CONCURRENCY_WINDOW", 50)
+        self.max_concurrency = s.getint("ADAPTIVE_CONCURRENCY_MAX", 64)
+        self.min_concurrency = s.getint("CONCURRENT_REQUESTS", 16)
+        self.slot_start_concurrency = s.getint("ADAPTIVE_CONCURRENCY_SLOT_START", 1)
+        self.slot_max_concurrency = s.getint("ADAPTIVE_CONCURRENCY_SLOT_MAX", 8)
+        self.target_latency = s.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY", 5)
+        self.max_error_rate = s.getfloat("ADAPTIVE_CONCURRENCY_ERROR_RATE", 0.1)
+        self.max_delay = s.getfloat("ADAPTIVE_CONCURRENCY_MAX_DELAY", 60)
+        self.error_statuses = set(
+            s.getlist("ADAPTIVE_CONCURRENCY_ERROR_STATUSES", [403, 429, 503])
+        )
+        self.slots = {}
+        self.total = SlotStats(self.window)
+        if s.getbool("AUTOTHROTTLE_ENABLED"):
+            logger.warning(
+                "AutoThrottle is enabled with adaptive concurrency: its download delays "
+                "limit each slot to one request per delay whatever its concurrency"
+            )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+
+        mw = cls(crawler)
+        crawler.signals.connect(
+            mw.request_reached_downloader, signal=signals.request_reached_downloader
+        )
+        return mw
+
+    def request_reached_downloader(self, request, spider):
+        """Apply the learned concurrency to the slot of the request before it is sent"""
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            self.init_slot(slot, self.get_stats(key))
+
+    def get_stats(self, key):
+        """Stats of the given slot, created on the first request of the slot"""
+        if key not in self.slots:
+            self.slots[key] = SlotStats(self.window, self.slot_start_concurrency)
+        return self.slots[key]
+
+    @staticmethod
+    def init_slot(slot, stats):
+        """Set the learned concurrency and delay on a new (or recreated) downloader slot"""
+        if stats.slot is not slot:
+            slot.concurrency = stats.concurrency
+            slot.delay = stats.delay
+            stats.slot = slot
+
+    def process_response(self, request, response, spider):
+        error = (
+            request.meta.get("_ban", False) or response.status in self.error_statuses
+        )
+        self.adjust(request, error, request.meta.get("download_latency"))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.adjust(request, True)
+
+    def adjust(self, request, error, latency=None):
+        """Record a response of the request's slot and adapt the slot and global concurrency"""
+        key = request.meta.get("download_slot")
+        stats = self.get_stats(key)
+        stats.record(error, None if error else latency)
+        self.total.record(error)
+
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            self.init_slot(slot, stats)
+            self.adjust_slot(key, slot, stats, error)
+        self.adjust_total()
+
+    def adjust_slot(self, key, slot, stats, error):
+        """Increase the concurrency of a fast and healthy slot, decrease or delay the others"""
+        old_concurrency, old_delay = slot.concurrency, slot.delay
+        # decrease at most once per latency, the responses of the requests sent before
+        # the last decrease do not reflect it yet
+        can_decrease = monotonic() - stats.changed_at >= (stats.latency or 0)
+        slow = stats.latency is not None and stats.latency > self.target_latency
+        if error:
+            if not can_decrease:
+                return
+            if slot.concurrency > 1:
+                slot.concurrency = max(1, slot.concurrency // 2)
+            else:
+                slot.delay = min(self.max_delay, max(2 * slot.delay, 1))
+        elif slot.delay:
+            slot.delay = slot.delay / 2 if slot.delay >= 0.1 else 0
+        elif slow:
+            if not can_decrease or slot.concurrency == 1:
+                return
+            slot.concurrency -= 1
+        elif (
+            stats.since_change >= slot.concurrency
+            and stats.error_rate <= self.max_error_rate
+            and slot.concurrency < self.slot_max_concurrency
+        ):
+            slot.concurrency += 1
+        else:
+            return
+
+        stats.concurrency, stats.delay = slot.concurrency, slot.delay
+        stats.changed()
+        logger.debug(
+            "Slot %s (latency: %.2fs, error rate: %.2f) concurrency: %d -> %d, delay: %.2fs -> %.2fs",
+            key,
+            stats.latency or 0,
+            stats.error_rate,
+            old_concurrency,
+            slot.concurrency,
+            old_delay,
+            slot.delay,
+        )
+
+    def adjust_total(self):
+        """Increase the global concurrency while the error rate is low, halve it otherwise"""
+        downloader = self.crawler.engine.downloader
+        total = downloader.total_concurrency
+        if (
+            len(self.total.outcomes) < self.window
+            or self.total.since_change < self.window
+        ):
+            return
+
+        if self.total.error_rate > self.max_error_rate:
+            total = max(self.min_concurrency, total // 2)
+        elif len(downloader.active) >= total:
+            total = min(self.max_concurrency, total + 1)
+
+        if total != downloader.total_concurrency:
+            logger.info(
+                "Global concurrency (error rate: %.2f): %d -> %d",
+                self.total.error_rate,
+                downloader.total_concurrency,
+                total,
+            )
+            downloader.total_concurrency = total
+            self.crawler.stats.set_value("adaptive_concurrency/total", total)
+        self.total.changed()
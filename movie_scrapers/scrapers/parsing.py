@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Field extraction helpers of the Box Office Mojo title pages, shared by the BoxOfficeSpider
+and modules/data_scraper.py. The general info sections and the crew table of a page are
+indexed in a single pass, so every field lookup is a dict access instead of a scan.
+"""
+
+import datetime
+import re
+
+# human readable duration, e.g. 2 hr 15 min
+RUNTIME_PATTERN = re.compile(
+    r"[-]?((?P<hours>\d+?)\s?hr)?\s?[-]?((?P<minutes>\d+?)\s?min)?"
+)
+MONEY_PATTERN = re.compile(r"[$,]")
+
+
+def index_sections(sections):
+    """
+    Index the general info sections (lists of texts) of a page by label: every text of a
+    section maps to the sections containing it, in page order.
+    """
+    index = {}
+    for section in sections:
+        for label in set(section):
+            index.setdefault(label, []).append(section)
+
+    return index
+
+
+def find_money(index, name):
+    """
+    Returns the amount (without $ and commas) of the last section labeled with the given
+    name, None if there is no such section or the amount is not available
+    """
+    for section in reversed(index.get(name, [])):
+        if section[-1] != "–":
+            return MONEY_PATTERN.sub("", section[-1])
+
+    return None
+
+
+def find_info(index, name):
+    """
+    Returns the value (second text) of the last section labeled with the given name,
+    None if there is no such section
+    """
+    for section in reversed(index.get(name, [])):
+        if len(section) > 1:
+            return section[1]
+
+    return None
+
+
+def index_roles(rows):
+    """
+    Index the names of a crew table (rows of name, role) by role, in table order.
+    Rows without a role are skipped.
+    """
+    roles = {}
+    for row in rows:
+        if len(row) > 1:
+            roles.setdefault(row[1], []).append(row[0])
+
+    return roles
+
+
+def convert_runtime(runtime):
+    """
+    Convert human readable duration format to minutes
+    returns given string if nothing is found
+    """
+    parts = RUNTIME_PATTERN.match(runtime)
+    if not parts:
+        return runtime
+    parts = parts.groupdict()
+    time_params = {}
+    for name, param in parts.items():
+        if param:
+            time_params[name] = int(param)
+    return int(datetime.timedelta(**time_params).total_seconds() / 60)
@@ -22,6 +22,7 @@ NEWSPIDER_MODULE = "scrapers.spiders"
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
+# With adaptive concurrency, it is the starting and lowest global concurrency
 CONCURRENT_REQUESTS = 4
 
 # Configure a delay for requests for the same website (default: 0)
@@ -70,6 +71,8 @@ CONCURRENT_REQUESTS = 4
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://doc.scrapy.org/en/latest/topics/autothrottle.html
+# Keep it disabled with adaptive concurrency: a slot with a download delay sends one
+# request per delay whatever its concurrency, the adaptive middleware sets delays itself
 # AUTOTHROTTLE_ENABLED = True
 # The initial download delay
 # AUTOTHROTTLE_START_DELAY = 5
@@ -93,6 +96,9 @@ LOG_FILE = "scraper_log.txt"
 LOG_LEVEL = "INFO"
 INPUT_FILE = "../data/movies.csv"
 OUTPUT_FILE = "../data/boxoffice_mojo.csv"
+PARSE_ENGINE = "selector"  # parse engine of the spider: selector (lxml XPath) or bs4 (BeautifulSoup)
+# number of processes parsing the pages off the reactor thread, 0 to parse in it
+PARSE_PROCESSES = 0
 
 # Proxybroker settings
 PROXY_COLLECTION_INTERVAL = (
@@ -121,6 +127,8 @@ ROTATING_PROXY_BACKOFF_BASE = 30
 ROTATING_PROXY_PAGE_RETRY_TIMES = 20
 ROTATING_PROXY_BACKOFF_CAP = 7200
 ROTATING_PROXY_CLOSE_SPIDER = False
+# number of random proxies tried to find one with free capacity
+ROTATING_PROXY_CHOICES = 4
 
 # random user agent
 # https://github.com/alecxe/scrapy-fake-useragent
@@ -129,8 +137,21 @@ FAKEUSERAGENT_FALLBACK = None
 RANDOM_UA_TYPE = "random"
 RANDOM_UA_PER_PROXY = False
 
+# Adaptive concurrency (scrapers.middlewares.AdaptiveConcurrencyMiddleware)
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_MAX = 64  # highest global concurrency
+ADAPTIVE_CONCURRENCY_SLOT_START = 1  # starting concurrency of a download slot (proxy)
+ADAPTIVE_CONCURRENCY_SLOT_MAX = 8  # highest concurrency of a download slot (proxy)
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 5  # seconds, slots slower than this are throttled
+ADAPTIVE_CONCURRENCY_ERROR_RATE = 0.1  # highest error rate concurrency still grows with
+ADAPTIVE_CONCURRENCY_WINDOW = 50  # number of last responses error rates are computed on
+ADAPTIVE_CONCURRENCY_MAX_DELAY = 60  # highest download delay of a throttled slot
+# statuses counted as errors, in addition to bans
+ADAPTIVE_CONCURRENCY_ERROR_STATUSES = [403, 429, 503]
+
 # DOWNLOADER_MIDDLEWARES = {
 #     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
 #     'scrapers.middlewares.CustomRotatingProxiesMiddleware': 610,
+#     'scrapers.middlewares.AdaptiveConcurrencyMiddleware': 615,
 #     'rotating_proxies.middlewares.BanDetectionMiddleware': 620,
 # }
@@ -1,13 +1,39 @@
-import datetime
 import logging
-import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import dateutil.parser
+import parsel
 import scrapy
 from bs4 import BeautifulSoup
+from lxml import etree
 from scrapy.exceptions import CloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
 
 from ..items import MoviesItem
+from ..parsing import (
+    convert_runtime,
+    find_info,
+    find_money,
+    index_roles,
+    index_sections,
+)
+
+# precompiled XPath expressions of the selector parse engine, matching the BeautifulSoup
+# lookups of the bs4 engine: class attribute equal to the classes in this order, text nodes
+# without the ones of scripts, styles and templates (ignored by get_text)
+GENERAL_INFO_XPATH = etree.XPath(
+    '//div[normalize-space(@class)="a-section a-spacing-none"]'
+)
+TABLE_XPATH = etree.XPath("(//table[@id=$table_id])[1]")
+ROW_XPATH = etree.XPath(".//tr")
+HEADER_XPATH = etree.XPath(".//th")
+DATA_XPATH = etree.XPath(".//td")
+TEXT_XPATH = etree.XPath(
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]"
+)
 
 
 class BoxOfficeSpider(scrapy.Spider):
@@ -22,6 +48,12 @@ class BoxOfficeSpider(scrapy.Spider):
     def __init__(self, *args, **kwargs):
         super(BoxOfficeSpider, self).__init__(*args, **kwargs)
         self.imdb_ids = kwargs.pop("imdb_ids", [])
+        # parse engine: selector (lxml) or bs4, defaults to the PARSE_ENGINE setting
+        self.parse_engine = kwargs.pop("parse_engine", None)
+        # number of processes extracting the items off the reactor thread, defaults to the
+        # PARSE_PROCESSES setting
+        self.parse_processes = kwargs.pop("parse_processes", None)
+        self._parse_pool = None
 
     def start_requests(self):
         for imdb_id in self.imdb_ids:
@@ -31,7 +63,7 @@ class BoxOfficeSpider(scrapy.Spider):
                 url=url, callback=self.parse, meta={"imdb_id": imdb_id}
             )
 
-    def parse(self, response):
+    async def parse(self, response):
         self.logger.info(f"Now parsing: {response.request.url}")
         if response.status == 200:
             self.consecutive_err = 0
@@ -40,164 +72,254 @@ class BoxOfficeSpider(scrapy.Spider):
             if self.consecutive_err == 10:
                 # stop spider on condition
                 raise CloseSpider("NUmber of error received from server has exceed")
-            return None
+            return
 
-        soup = BeautifulSoup(response.text, "html.parser")
+        engine = self.parse_engine or self.settings.get("PARSE_ENGINE", "bs4")
         try:
-            general_info = soup.find_all("div", {"class": "a-section a-spacing-none"})
-            # self.logger.info(general_info)
-            general_info = [
-                mon.get_text("@", strip=True)
-                .replace("(", "")
-                .replace(")", "")
-                .split("@")
-                for mon in general_info
-            ]
-            self.logger.info(general_info)
-
-            # get Title, year and tagline
-            title_year_tagline = general_info[0]
-            for i in range(0, 3):
-                if i >= len(title_year_tagline):
-                    title_year_tagline.append(None)
-
-            title = title_year_tagline[0]
-            year = title_year_tagline[1]
-            # sometimes tagline my be divided with other html tags, so merge it
-            tagline = title_year_tagline[2]
-            if tagline and len(title_year_tagline) > 3:
-                tagline = "".join(
-                    [
-                        _tagline
-                        for _tagline in title_year_tagline[2:]
-                        if _tagline is not None
-                    ]
+            parse_pool = self._get_parse_pool()
+            if parse_pool is None:
+                yield BoxOfficeSpider.extract_item(
+                    response.text, response.meta.get("imdb_id"), engine, self.logger
                 )
-
-            # get money
-            domestic = BoxOfficeSpider._find_money(general_info, "Domestic ")
-            international = BoxOfficeSpider._find_money(general_info, "International ")
-            worldwide = BoxOfficeSpider._find_money(general_info, "Worldwide")
-            budget = BoxOfficeSpider._find_money(general_info, "Budget")
-
-            # get picture rating(mpaa), runtime and genre
-            distributor = BoxOfficeSpider._find_info(
-                general_info, "Domestic Distributor"
-            )
-            release_date = BoxOfficeSpider._find_info(
-                general_info, "Earliest Release Date"
-            )
-            if release_date:  # convert human readable date format to standard format
-                release_date = release_date.split("\n")[0]
-                release_date = dateutil.parser.parse(release_date).strftime("%Y-%m-%d")
-
-            # mpaa = BoxOfficeSpider._find_info(general_info, 'MPAA')
-            run_time = BoxOfficeSpider._find_info(general_info, "Running Time")
-            if run_time:  # convert duration to minutes
-                run_time = BoxOfficeSpider._convert_runtime(run_time)
-
-            genres = BoxOfficeSpider._find_info(general_info, "Genres")
-            if genres:
-                genres = genres.replace("\n", "").split()
-                genres = ", ".join(genres)
-
-            # get crews
-            writer, director, producer, composer, cinematographer = (
-                None,
-                None,
-                None,
-                None,
-                None,
-            )
-            crews = soup.find("table", {"id": "principalCrew"})
-            if crews:
-                crews = BoxOfficeSpider._table_data_text(crews)
-                writer = BoxOfficeSpider._find_crew("Writer", crews)
-                director = BoxOfficeSpider._find_crew("Director", crews)
-                producer = BoxOfficeSpider._find_crew("Producer", crews)
-                composer = BoxOfficeSpider._find_crew("Composer", crews)
-                cinematographer = BoxOfficeSpider._find_crew("Cinematographer", crews)
-
-            # get main actors
-            casts = soup.find("table", {"id": "principalCast"})
-            if casts:
-                casts = BoxOfficeSpider._table_data_text(casts)
-                casts = (
-                    ", ".join([actor[0] for actor in casts][1:])
-                    if len(casts) > 0
-                    else None
+            else:
+                # the reactor keeps downloading while the page is parsed in the pool
+                yield await maybe_deferred_to_future(
+                    BoxOfficeSpider._defer_to_pool(
+                        parse_pool,
+                        BoxOfficeSpider.extract_item,
+                        response.text,
+                        response.meta.get("imdb_id"),
+                        engine,
+                    )
                 )
 
-            # set movies item
-            movies_item = MoviesItem()
-            movies_item["title"] = title
-            movies_item["date"] = release_date
-            movies_item["tagline"] = tagline
-            movies_item["genres"] = genres
-            movies_item["runtime"] = run_time
-            movies_item["revenue"] = worldwide
-            movies_item["budget"] = budget
-            movies_item["director"] = director
-            movies_item["production_companies"] = distributor
-            movies_item["cast"] = casts
-            movies_item["imdb_id"] = response.meta.get("imdb_id")
-
-            yield movies_item
-
         except Exception as err:
             self.logger.error((err))
             self.logger.error(f"URL:{response.request.url}")
             raise
 
-    @staticmethod
-    def _find_money(list_, name):
-        output = None
-        for sublist in list_:
-            if name in sublist and sublist[-1] != "–":
-                output = int(sublist[-1].replace("$", "").replace(",", ""))
+    def _get_parse_pool(self):
+        """
+        Returns the process pool of the item extraction, started on first use.
+        None if the items are extracted in the reactor thread.
+        """
+        if self._parse_pool is None:
+            processes = int(
+                self.parse_processes or self.settings.getint("PARSE_PROCESSES", 0)
+            )
+            if processes > 0:
+                # spawn, forking the threads of the reactor is not safe
+                self._parse_pool = ProcessPoolExecutor(
+                    processes, mp_context=multiprocessing.get_context("spawn")
+                )
+                self.logger.info(f"Parsing pages with {processes} processes")
+        return self._parse_pool
 
-        return output
+    def closed(self, reason):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
 
     @staticmethod
-    def _find_info(list_, name):
+    def _defer_to_pool(pool, func, *args):
         """
-        Searches through a list and returns a specific value from
-        sublist that contains given name
+        Runs the function in the process pool and returns a Deferred fired in the reactor
+        thread with its result.
         """
-        output = None
-        for sublist in list_:
-            if name in sublist:
-                if len(sublist) > 1:
-                    output = sublist[1]
+        from twisted.internet import reactor
+
+        deferred = Deferred()
+
+        def fire(future):
+            if future.exception() is not None:
+                deferred.errback(Failure(future.exception()))
+            else:
+                deferred.callback(future.result())
 
-        return output
+        future = pool.submit(func, *args)
+        future.add_done_callback(lambda future: reactor.callFromThread(fire, future))
+        return deferred
 
     @staticmethod
-    def _convert_runtime(runtime):
+    def extract_item(html, imdb_id, engine="selector", logger=None):
         """
-        Convert human readable duration format to minutes
-        returns given string if nothing is found
+        Extracts the movies item of a title credits page with the given parse engine,
+        selector (lxml XPath expressions) or bs4 (BeautifulSoup with html.parser).
+        Both engines give the same item.
         """
-        regex = re.compile(
-            r"[-]?((?P<hours>\d+?)\s?hr)?\s?[-]?((?P<minutes>\d+?)\s?min)?"
+        if engine == "selector":
+            general_info, crews, casts = BoxOfficeSpider._extract_selector(html)
+        elif engine == "bs4":
+            general_info, crews, casts = BoxOfficeSpider._extract_bs4(html)
+        else:
+            raise ValueError(f"Unknown parse engine: {engine}")
+
+        general_info = [
+            mon.replace("(", "").replace(")", "").split("@") for mon in general_info
+        ]
+        if logger is not None:
+            logger.info(general_info)
+        # single pass over the sections, the fields are then looked up by label
+        sections = index_sections(general_info)
+
+        # get Title, year and tagline
+        title_year_tagline = general_info[0]
+        for i in range(0, 3):
+            if i >= len(title_year_tagline):
+                title_year_tagline.append(None)
+
+        title = title_year_tagline[0]
+        year = title_year_tagline[1]
+        # sometimes tagline my be divided with other html tags, so merge it
+        tagline = title_year_tagline[2]
+        if tagline and len(title_year_tagline) > 3:
+            tagline = "".join(
+                [
+                    _tagline
+                    for _tagline in title_year_tagline[2:]
+                    if _tagline is not None
+                ]
+            )
+
+        # get money
+        domestic = BoxOfficeSpider._find_money(sections, "Domestic ")
+        international = BoxOfficeSpider._find_money(sections, "International ")
+        worldwide = BoxOfficeSpider._find_money(sections, "Worldwide")
+        budget = BoxOfficeSpider._find_money(sections, "Budget")
+
+        # get picture rating(mpaa), runtime and genre
+        distributor = find_info(sections, "Domestic Distributor")
+        release_date = find_info(sections, "Earliest Release Date")
+        if release_date:  # convert human readable date format to standard format
+            release_date = release_date.split("\n")[0]
+            release_date = dateutil.parser.parse(release_date).strftime("%Y-%m-%d")
+
+        # mpaa = find_info(sections, 'MPAA')
+        run_time = find_info(sections, "Running Time")
+        if run_time:  # convert duration to minutes
+            run_time = convert_runtime(run_time)
+
+        genres = find_info(sections, "Genres")
+        if genres:
+            genres = genres.replace("\n", "").split()
+            genres = ", ".join(genres)
+
+        # get crews
+        writer, director, producer, composer, cinematographer = (
+            None,
+            None,
+            None,
+            None,
+            None,
         )
-        parts = regex.match(runtime)
-        if not parts:
-            return runtime
-        parts = parts.groupdict()
-        time_params = {}
-        for (name, param) in parts.items():
-            if param:
-                time_params[name] = int(param)
-        return int(datetime.timedelta(**time_params).total_seconds() / 60)
+        if crews:
+            roles = index_roles(crews)
+            writer = BoxOfficeSpider._find_crew("Writer", roles)
+            director = BoxOfficeSpider._find_crew("Director", roles)
+            producer = BoxOfficeSpider._find_crew("Producer", roles)
+            composer = BoxOfficeSpider._find_crew("Composer", roles)
+            cinematographer = BoxOfficeSpider._find_crew("Cinematographer", roles)
+
+        # get main actors
+        if casts is not None:
+            casts = (
+                ", ".join([actor[0] for actor in casts][1:]) if len(casts) > 0 else None
+            )
+
+        # set movies item
+        movies_item = MoviesItem()
+        movies_item["title"] = title
+        movies_item["date"] = release_date
+        movies_item["tagline"] = tagline
+        movies_item["genres"] = genres
+        movies_item["runtime"] = run_time
+        movies_item["revenue"] = worldwide
+        movies_item["budget"] = budget
+        movies_item["director"] = director
+        movies_item["production_companies"] = distributor
+        movies_item["cast"] = casts
+        movies_item["imdb_id"] = imdb_id
+
+        return movies_item
+
+    @staticmethod
+    def _extract_bs4(html):
+        """
+        Extracts the texts of the general info sections (joined with @) and the rows of the
+        crew and cast tables (None if there is no table) with BeautifulSoup.
+        """
+        soup = BeautifulSoup(html, "html.parser")
+        general_info = soup.find_all("div", {"class": "a-section a-spacing-none"})
+        general_info = [mon.get_text("@", strip=True) for mon in general_info]
+
+        crews = soup.find("table", {"id": "principalCrew"})
+        if crews:
+            crews = BoxOfficeSpider._table_data_text(crews)
+
+        casts = soup.find("table", {"id": "principalCast"})
+        if casts:
+            casts = BoxOfficeSpider._table_data_text(casts)
+
+        return general_info, crews, casts
+
+    @staticmethod
+    def _extract_selector(html):
+        """
+        Same as _extract_bs4 with the lxml tree of Scrapy selectors and precompiled XPath
+        expressions.
+        """
+        root = parsel.Selector(text=html).root
+        general_info = [
+            "@".join(BoxOfficeSpider._stripped_texts(mon))
+            for mon in GENERAL_INFO_XPATH(root)
+        ]
+
+        crews = TABLE_XPATH(root, table_id="principalCrew")
+        crews = BoxOfficeSpider._table_rows(crews[0]) if crews else None
+
+        casts = TABLE_XPATH(root, table_id="principalCast")
+        casts = BoxOfficeSpider._table_rows(casts[0]) if casts else None
+
+        return general_info, crews, casts
+
+    @staticmethod
+    def _stripped_texts(element):
+        """Returns the not empty stripped text nodes of the element, as bs4 get_text"""
+        return [text for text in (text.strip() for text in TEXT_XPATH(element)) if text]
+
+    @staticmethod
+    def _table_rows(table):
+        """lxml version of _table_data_text"""
+
+        def row_get_data_text(tr, coltag_xpath):
+            return [
+                "".join(BoxOfficeSpider._stripped_texts(td)) for td in coltag_xpath(tr)
+            ]
+
+        rows = []
+        trs = ROW_XPATH(table)
+        header_row = row_get_data_text(trs[0], HEADER_XPATH)
+        if header_row:  # if there is a header row include first
+            rows.append(header_row)
+            trs = trs[1:]
+        for tr in trs:  # for every other table rows
+            rows.append(row_get_data_text(tr, DATA_XPATH))  # data row
+
+        return rows
+
+    @staticmethod
+    def _find_money(sections, name):
+        """Returns the amount of the section with the given label, see find_money"""
+        output = find_money(sections, name)
+        return int(output) if output is not None else None
 
     @staticmethod
-    def _find_crew(role, crews):
+    def _find_crew(role, roles):
         """
-        Finds values with given role and concat with comma
+        Finds names with given role and concat with comma
         returns None if nothing is found
         """
-        output = [crew[0] for crew in crews if len(crew) > 1 and crew[1] == role]
+        output = roles.get(role)
         return ", ".join(output) if output else None
 
     @staticmethod